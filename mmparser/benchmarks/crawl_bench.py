@@ -0,0 +1,297 @@
+"""Замеры производительности полного прохода парсера на локальном моке api
+
+Каждый сценарий запускается в отдельном процессе, чтобы пиковая память
+и глобальное состояние (БД, логгер) не смешивались между сценариями.
+Мок api работает в основном процессе и отвечает и как прокси, поэтому
+число прокси в файле задает число соединений парсера.
+
+Запуск из каталога mmparser:
+    python -m benchmarks.crawl_bench -output bench.json
+    python -m benchmarks.crawl_bench -scenarios connections-1,warm-db -baseline bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter, sleep
+
+from rich.console import Console
+from rich.table import Table
+
+from tests.mock_api import MockApi
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+SEARCH_URL = "https://megamarket.ru/catalog/?q=%D0%BD%D0%BE%D1%83%D1%82%D0%B1%D1%83%D0%BA"
+# ИНН продавца "Электроника Онлайн" из фикстур мока
+BLACKLIST_INNS = ["5404492917"]
+TG_CONFIG = "0:benchmark$1"
+
+# базовый сценарий: 8 соединений, холодная БД, карточки по умолчанию, без черного списка
+SCENARIOS = {
+    "connections-1": {"connections": 1},
+    "connections-8": {"connections": 8},
+    "connections-64": {"connections": 64},
+    "all-cards": {"connections": 8, "all_cards": True},
+    "no-cards": {"connections": 8, "no_cards": True},
+    "merchant-blacklist": {"connections": 8, "use_merchant_blacklist": True},
+    "warm-db": {"connections": 8, "warm": True},
+}
+# метрика -> больше значит лучше
+COMPARED_METRICS = {
+    "pages_per_sec": True,
+    "offers_per_sec": True,
+    "db_writes_per_sec": True,
+    "latency_p95_ms": False,
+}
+
+
+def percentile(values: list[float], percent: float) -> float | None:
+    """Перцентиль по ближайшему рангу"""
+    if not values:
+        return None
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, round(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+def peak_rss_mb() -> float | None:
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # на macOS в байтах, на linux в килобайтах
+    return round(max_rss / 1024 / 1024 if sys.platform == "darwin" else max_rss / 1024, 1)
+
+
+def _create_parser(scenario: dict, options: argparse.Namespace):
+    from core.parser_url import Parser_url
+
+    return Parser_url(
+        url=SEARCH_URL,
+        urls=[],
+        api_base_url=options.api_url,
+        proxy_file_path="proxies.txt",
+        tg_config=TG_CONFIG,
+        all_cards=scenario.get("all_cards", False),
+        no_cards=scenario.get("no_cards", False),
+        use_merchant_blacklist=scenario.get("use_merchant_blacklist", False),
+        bonus_percent_alert=20,
+        delay=0.01,
+        min_delay=0.01,
+        error_delay=0.5,
+        engine=options.engine,
+        cycles=1,
+        log_level="WARNING",
+    )
+
+
+def _instrument(parser, latencies: list[float], page_sleeps: list[float], jobs: list, page_sleep: bool) -> None:
+    """Собрать время попыток запросов из метрик парсера, паузы между страницами и итоги url"""
+    from core import parser_url
+
+    observe = parser.metrics.observe
+
+    def collect_observe(api_url, proxy_string, latency, *args, **kwargs):
+        # время одной попытки, без ожидания соединения и повторов
+        latencies.append(latency)
+        observe(api_url, proxy_string, latency, *args, **kwargs)
+
+    parser.metrics.observe = collect_observe
+
+    def page_pause(seconds):
+        # пауза после страницы есть только в движке threads, без нее движки сравнимы
+        page_sleeps.append(seconds)
+        if page_sleep:
+            sleep(seconds)
+
+    parser_url.sleep = page_pause
+
+    log_job_result = parser._log_job_result
+
+    def collect_job_result(job):
+        jobs.append(job)
+        log_job_result(job)
+
+    parser._log_job_result = collect_job_result
+
+
+def run_scenario(name: str, options: argparse.Namespace) -> dict:
+    """Прогнать сценарий в текущем процессе, рабочий каталог с прокси и черным списком уже подготовлен"""
+    from core import db_utils
+
+    scenario = SCENARIOS[name]
+    if scenario.get("warm"):
+        # прогрев: предложения попадают в БД, замеряемый проход видит их без изменений
+        _create_parser(scenario, options).parse()
+    parser = _create_parser(scenario, options)
+    latencies: list[float] = []
+    page_sleeps: list[float] = []
+    jobs: list = []
+    _instrument(parser, latencies, page_sleeps, jobs, options.page_sleep)
+    rows_before = db_utils.execute_read("SELECT COUNT(*) FROM products")[0][0]
+    alerts_before = db_utils.execute_read("SELECT COUNT(*) FROM notifications")[0][0]
+    started_at = perf_counter()
+    parser.parse()
+    wall_time = perf_counter() - started_at
+    parser.tg_client.close(timeout=0)
+    return {
+        "wall_time": wall_time,
+        "offers": sum(job.scraped_items_counter for job in jobs),
+        "changed_offers": sum(job.changed_offers_counter for job in jobs),
+        "requests": len(latencies),
+        "latency_p50_ms": _ms(percentile(latencies, 50)),
+        "latency_p95_ms": _ms(percentile(latencies, 95)),
+        "latency_p99_ms": _ms(percentile(latencies, 99)),
+        "page_sleep_s": round(sum(page_sleeps), 1),
+        "db_writes": db_utils.execute_read("SELECT COUNT(*) FROM products")[0][0] - rows_before,
+        "alerts": db_utils.execute_read("SELECT COUNT(*) FROM notifications")[0][0] - alerts_before,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def _ms(seconds: float | None) -> float | None:
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def _run_child(name: str, api: MockApi, options: argparse.Namespace) -> dict:
+    """Запустить сценарий в отдельном процессе и дополнить результат счетчиками мока"""
+    scenario = SCENARIOS[name]
+    with tempfile.TemporaryDirectory() as work_dir:
+        work_dir = Path(work_dir)
+        proxies = [api.proxy_url(f"bench{i}") for i in range(scenario["connections"])]
+        (work_dir / "proxies.txt").write_text("\n".join(proxies), encoding="utf-8")
+        (work_dir / "merchant_blacklist.txt").write_text("\n".join(BLACKLIST_INNS), encoding="utf-8")
+        result_file = work_dir / "result.json"
+        pages_before = api.calls.get("catalogService/catalog/search", 0)
+        command = [
+            sys.executable, "-m", "benchmarks.crawl_bench",
+            "-child", name,
+            "-work-dir", str(work_dir),
+            "-result-file", str(result_file),
+            "-api-url", api.base_url,
+            "-engine", options.engine,
+        ]  # fmt: skip
+        if options.page_sleep:
+            command.append("-page-sleep")
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(ROOT_DIR), os.environ.get("PYTHONPATH")])))
+        completed = subprocess.run(command, cwd=ROOT_DIR, env=env, capture_output=True, text=True)
+        if completed.returncode or not result_file.exists():
+            raise RuntimeError(f"Сценарий {name} завершился с ошибкой:\n{completed.stderr[-4000:]}")
+        metrics = json.loads(result_file.read_text(encoding="utf-8"))
+    pages = api.calls.get("catalogService/catalog/search", 0) - pages_before
+    if scenario.get("warm"):
+        # страницы прогрева не считаются
+        pages //= 2
+    wall_time = metrics["wall_time"]
+    metrics.update(
+        pages=pages,
+        pages_per_sec=round(pages / wall_time, 2),
+        offers_per_sec=round(metrics["offers"] / wall_time, 2),
+        db_writes_per_sec=round(metrics["db_writes"] / wall_time, 2),
+        alerts_per_sec=round(metrics["alerts"] / wall_time, 2),
+        wall_time=round(wall_time, 3),
+    )
+    return {"params": scenario, "metrics": metrics}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Метрики, которые ухудшились относительно `baseline` больше чем на `tolerance`"""
+    regressions = []
+    for name, result in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            current, previous = result["metrics"].get(metric), base["metrics"].get(metric)
+            if not current or not previous:
+                continue
+            change = current / previous - 1
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                regressions.append(f"{name}: {metric} {previous} -> {current} ({change:+.0%})")
+    return regressions
+
+
+def print_table(results: dict) -> None:
+    table = Table(title="Замеры парсера")
+    columns = {
+        "pages_per_sec": "стр/с",
+        "offers_per_sec": "предл/с",
+        "latency_p50_ms": "p50 мс",
+        "latency_p95_ms": "p95 мс",
+        "latency_p99_ms": "p99 мс",
+        "page_sleep_s": "паузы с",
+        "db_writes_per_sec": "БД зап/с",
+        "alerts_per_sec": "увед/с",
+        "peak_rss_mb": "RSS МБ",
+    }
+    table.add_column("Сценарий")
+    for title in columns.values():
+        table.add_column(title, justify="right")
+    for name, result in results["scenarios"].items():
+        table.add_row(name, *(str(result["metrics"].get(column)) for column in columns))
+    Console().print(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры производительности парсера на моке api")
+    parser.add_argument("-scenarios", type=str, default=",".join(SCENARIOS), help=f"Сценарии через запятую. По умолчанию: {','.join(SCENARIOS)}")
+    parser.add_argument("-total", type=int, default=1000, help="Товаров в каталоге мока. По умолчанию: 1000")
+    parser.add_argument("-latency", type=float, default=0.02, help="Задержка ответа мока, в секундах. По умолчанию: 0.02")
+    parser.add_argument("-engine", choices=["threads", "async"], default="threads", help="Движок парсера. По умолчанию: threads")
+    parser.add_argument("-page-sleep", action="store_true", help="Выполнять паузу 1 с после страницы в движке threads")
+    parser.add_argument("-output", type=str, help="Сохранить результаты в json")
+    parser.add_argument("-baseline", type=str, help="Json с прошлыми результатами для сравнения")
+    parser.add_argument("-tolerance", type=float, default=0.2, help="Допустимое ухудшение метрик относительно baseline. По умолчанию: 0.2")
+    # запуск одного сценария в дочернем процессе
+    parser.add_argument("-child", type=str, help=argparse.SUPPRESS)
+    parser.add_argument("-work-dir", type=str, help=argparse.SUPPRESS)
+    parser.add_argument("-result-file", type=str, help=argparse.SUPPRESS)
+    parser.add_argument("-api-url", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        os.chdir(args.work_dir)
+        from core import telegram
+
+        # уведомления уходят в мок
+        telegram.TELEGRAM_API_URL = args.api_url.split("/api/", 1)[0]
+        metrics = run_scenario(args.child, args)
+        Path(args.result_file).write_text(json.dumps(metrics), encoding="utf-8")
+        return
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Неизвестные сценарии: {', '.join(unknown)}")
+    results = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": {"total": args.total, "latency": args.latency, "engine": args.engine, "page_sleep": args.page_sleep},
+        "scenarios": {},
+    }
+    with MockApi(total=args.total, latency=args.latency) as api:
+        for name in names:
+            print(f"Сценарий {name}...", flush=True)
+            results["scenarios"][name] = _run_child(name, api, args)
+    print_table(results)
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Регрессия {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+"""Асинхронный движок парсинга каталога или поиска"""
+
+import asyncio
+import json
+from time import time
+from typing import TYPE_CHECKING
+from urllib.parse import urljoin
+
+from curl_cffi import CurlInfo
+from curl_cffi.requests import AsyncSession
+
+from .models import Connection, CrawlJob
+from .exceptions import ApiError
+from . import db_utils
+
+if TYPE_CHECKING:
+    from .parser_url import Parser_url
+
+
+class AsyncCrawler:
+    """Парсинг страниц, предложений и продавцов корутинами вместо пула потоков
+
+    Использует соединения и логику разбора `Parser_url`, меняется только транспорт.
+    Соединения занимаются из общего пула `Parser_url`, как и в запросах из потоков:
+    подготовке url, подборе размера страницы, карточках и списке наблюдения.
+    """
+
+    def __init__(self, parser: "Parser_url"):
+        self.parser = parser
+        self.logger = parser.logger
+        self.pool = parser.pool
+        self.sessions: dict[Connection, AsyncSession] = {}
+        self.loop: asyncio.AbstractEventLoop = None
+        self.released: asyncio.Event = None
+        self.merchant_inn_tasks: dict[str, asyncio.Future] = {}
+        self.request_tasks: dict[tuple[str, str], asyncio.Future] = {}
+
+    def _get_session(self, connection: Connection) -> AsyncSession:
+        """Получить асинхронную сессию соединения"""
+        if connection not in self.sessions:
+            self.sessions[connection] = AsyncSession(
+                proxy=connection.proxy_string,
+                verify=False,
+                impersonate="chrome120",
+                http_version="v2tls",
+                curl_infos=[CurlInfo.NUM_CONNECTS],
+            )
+        return self.sessions[connection]
+
+    async def _close_sessions(self) -> None:
+        for session in self.sessions.values():
+            await session.close()
+        self.sessions.clear()
+
+    def _on_release(self) -> None:
+        """Соединение вернули в пул, возможно из другого потока: разбудить ждущие корутины"""
+        try:
+            self.loop.call_soon_threadsafe(self.released.set)
+        except RuntimeError:
+            # цикл событий уже закрыт
+            pass
+
+    async def _acquire(self) -> Connection:
+        """Дождаться и занять соединение из пула, не блокируя цикл событий"""
+        started_at = time()
+        while True:
+            self.released.clear()
+            connection, wait_time = self.pool.try_acquire(started_at)
+            if connection is not None:
+                return connection
+            try:
+                await asyncio.wait_for(self.released.wait(), wait_time)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _api_request(self, api_url: str, json_data: dict, tries: int = 10, delay: float = 0) -> dict:
+        """Запрос к api через общий с `Parser_url` кэш ответов, одинаковые одновременные запросы объединяются"""
+        parser = self.parser
+        parser._add_auth(json_data)
+        if not parser._is_cached(api_url):
+            return await self._send_api_request(api_url, json_data, tries, delay)
+        key = parser._request_key(api_url, json_data)
+        response_text = parser.request_cache.get(key)
+        if response_text is not None:
+            parser.request_cache_hits += 1
+            return json.loads(response_text)
+        if key not in self.request_tasks:
+            self.request_tasks[key] = asyncio.ensure_future(self._cached_api_request(key, api_url, json_data, tries, delay))
+        try:
+            return json.loads(await asyncio.shield(self.request_tasks[key]))
+        finally:
+            task = self.request_tasks.get(key)
+            if task is not None and task.done():
+                del self.request_tasks[key]
+
+    async def _cached_api_request(self, key: tuple[str, str], api_url: str, json_data: dict, tries: int, delay: float) -> str:
+        response_text = json.dumps(await self._send_api_request(api_url, json_data, tries, delay), ensure_ascii=False)
+        self.parser.request_cache.set(key, response_text)
+        return response_text
+
+    async def _send_api_request(self, api_url: str, json_data: dict, tries: int, delay: float) -> dict:
+        recorder = self.parser.recorder
+        if recorder is not None and recorder.replay:
+            return recorder.load(api_url, json_data)
+        for i in range(0, tries):
+            connection = await self._acquire()
+            self.logger.debug("Прокси : %s", connection.proxy_string)
+            # по умолчанию соединение отдыхает перед следующей попыткой
+            usable_at = time() + 1 * i
+            request_started_at = time()
+            try:
+                response = await self._get_session(connection).post(api_url, json=json_data)
+                # счетчики общие с запросами из потоков
+                with connection.session_lock:
+                    connection.record_request(response)
+            except Exception:
+                response = None
+            response_data = self.parser._response_data(response)
+            latency = time() - request_started_at
+            self.parser.metrics.observe(api_url, connection.proxy_string, latency, response, response_data, retry=i > 0)
+            try:
+                if response_data is not None and response.status_code == 200 and not response_data.get("error"):
+                    connection.record_success(latency)
+                    usable_at = time() + self.parser._request_delay(connection, delay)
+                    if recorder is not None:
+                        recorder.save(api_url, json_data, response_data)
+                    return response_data
+                if response_data is not None and response.status_code == 200 and response_data.get("code") == 7:
+                    self.logger.debug("Соединение %s: слишком частые запросы", connection.proxy_string)
+                    connection.record_rate_limit(latency)
+                    usable_at = time() + self.parser.connection_error_delay
+                elif self.parser._is_connection_error(response) and self.pool.record_error(connection):
+                    self.parser._log_quarantine(connection)
+            finally:
+                self.pool.release(connection, usable_at)
+
+        raise ApiError("Ошибка получения данных api")
+
+    async def _get_page(self, job: CrawlJob, offset: int) -> dict:
+        """Получить страницу каталога или поиска"""
+        response_json = await self._api_request(
+            self.parser._api_url("catalogService/catalog/search"),
+            self.parser._page_payload(job, offset),
+            delay=self.parser.connection_success_delay,
+        )
+        if response_json.get("error") or response_json.get("success") is not True:
+            raise ApiError()
+        return response_json
+
+    async def _get_offers(self, goods_id: str) -> list[dict]:
+        """Получить список предложений товара"""
+        response_json = await self._api_request(
+            self.parser._api_url("catalogService/productOffers/get"),
+            self.parser._offers_payload(goods_id),
+            delay=self.parser.connection_success_delay,
+        )
+        return response_json["offers"]
+
+    async def _get_merchant_inn(self, merchant_id: str) -> str:
+        """Получить ИНН по ID продавца, сначала из кэша"""
+        merchant_inn = self.parser.merchant_inn_cache.get(merchant_id)
+        if merchant_inn is not None:
+            return merchant_inn
+        # одновременные запросы одного продавца ждут первый
+        if merchant_id not in self.merchant_inn_tasks:
+            self.merchant_inn_tasks[merchant_id] = asyncio.ensure_future(self._load_merchant_inn(merchant_id))
+        try:
+            return await asyncio.shield(self.merchant_inn_tasks[merchant_id])
+        finally:
+            task = self.merchant_inn_tasks.get(merchant_id)
+            if task is not None and task.done():
+                del self.merchant_inn_tasks[merchant_id]
+
+    async def _load_merchant_inn(self, merchant_id: str) -> str:
+        """Получить ИНН продавца из БД или api и закэшировать"""
+        # чтение ждет общего соединения БД, цикл событий в это время не блокируется
+        merchant_inn = await asyncio.to_thread(db_utils.get_merchant_inn, merchant_id)
+        if merchant_inn is None:
+            merchant_inn = await self._request_merchant_inn(merchant_id)
+            # запись только ставится в очередь фонового потока БД
+            db_utils.save_merchant_inn(merchant_id, merchant_inn)
+        self.parser.merchant_inn_cache.set(merchant_id, merchant_inn)
+        return merchant_inn
+
+    async def _request_merchant_inn(self, merchant_id: str) -> str:
+        """Получить ИНН по ID продавца через api"""
+        response_json = await self._api_request(
+            self.parser._api_url("partnerService/merchant/legalInfo/get"),
+            {"merchantId": merchant_id},
+        )
+        return response_json["merchant"]["legalInfo"]["inn"]
+
+    async def _get_merchant_inns(self, merchant_names_ids: list[tuple[str, str]]) -> list[str | None]:
+        """Получить ИНН продавцов, которых нет в обычном блеклисте"""
+        if not self.parser.use_merchant_blacklist:
+            return [None] * len(merchant_names_ids)
+
+        async def get_inn(merchant_name: str, merchant_id: str) -> str | None:
+            if merchant_name in self.parser.blacklist:
+                return None
+            return await self._get_merchant_inn(merchant_id)
+
+        return await asyncio.gather(*(get_inn(name, merchant_id) for name, merchant_id in merchant_names_ids))
+
+    async def _process_page(self, job: CrawlJob, offset: int, main_job, response_json: dict = None) -> bool:
+        """Получение и парсинг страницы каталога или поиска, `response_json` - уже загруженная страница"""
+        parser = self.parser
+        response_json = response_json or await self._get_page(job, offset)
+        items_per_page = int(response_json.get("limit"))
+        if items_per_page == 0:
+            # костыль для косяка мм
+            return False
+        page_progress = parser.rich_progress.add_task(f"[orange]{job.job_name}: страница {int(int(response_json.get('offset')) / items_per_page) + 1}")
+        parser.rich_progress.update(page_progress, total=len(response_json["items"]))
+        items = []
+        for item in response_json["items"]:
+            if parser._skip_item_check(item):
+                continue
+            if item["favoriteOffer"]["bonusPercent"] >= parser.bonus_percent_alert:
+                items.append(item)
+            else:
+                parser._watch_item(job, item)
+        # Сеть параллельно, разбор строго в порядке товаров на странице
+        results = await asyncio.gather(*(self._prefetch_item(job, item) for item in items))
+        for item, prefetched in zip(items, results):
+            self._parse_prefetched(job, item, prefetched)
+        parser.rich_progress.update(page_progress, completed=len(response_json["items"]))
+        parser.rich_progress.remove_task(page_progress)
+        parser.rich_progress.update(main_job, advance=1)
+        return bool(response_json["items"] and response_json["items"][-1]["isAvailable"])
+
+    async def _prefetch_item(self, job: CrawlJob, item: dict) -> tuple[list[dict] | None, list[str | None]]:
+        """Загрузить предложения и ИНН продавцов товара"""
+        if self.parser._parse_offers_check(job, item):
+            self.logger.info("Парсим предложения %s", item["goods"]["title"])
+            offers = await self._get_offers(item["goods"]["goodsId"])
+            inns = await self._get_merchant_inns([(offer["merchantName"], offer["merchantId"]) for offer in offers])
+            return offers, inns
+        favorite_offer = item["favoriteOffer"]
+        inns = await self._get_merchant_inns([(favorite_offer["merchantName"], favorite_offer["merchantId"])])
+        return None, inns
+
+    def _parse_prefetched(self, job: CrawlJob, item: dict, prefetched: tuple[list[dict] | None, list[str | None]]) -> None:
+        offers, inns = prefetched
+        if offers is None:
+            self.parser._parse_item(job, item, inns[0])
+            return
+        for offer, merchant_inn in zip(offers, inns):
+            self.parser._parse_offer(job, item["goods"], offer, merchant_inn)
+
+    async def parse_jobs(self, jobs: list[CrawlJob]) -> None:
+        """Парсинг url в одном цикле событий, не больше `url_threads` одновременно"""
+        self.loop = asyncio.get_running_loop()
+        self.released = asyncio.Event()
+        self.pool.add_listener(self._on_release)
+        url_slots = asyncio.Semaphore(self.parser.url_threads)
+
+        async def parse_job(job: CrawlJob) -> None:
+            async with url_slots:
+                try:
+                    await self._single_url(job)
+                except Exception:
+                    job.failed = True
+                    self.logger.exception("Ошибка парсинга %s", job.url)
+
+        try:
+            await asyncio.gather(*(parse_job(job) for job in jobs))
+        finally:
+            self.pool.remove_listener(self._on_release)
+            await self._close_sessions()
+
+    async def _single_url(self, job: CrawlJob) -> None:
+        parser = self.parser
+        await asyncio.to_thread(parser._prepare_job, job)
+        if job.parsed_url["type"] == "TYPE_PRODUCT_CARD":
+            await asyncio.to_thread(parser._parse_card, job)
+        else:
+            await self._parse_multi_page(job)
+        parser._log_job_result(job)
+
+    async def _parse_multi_page(self, job: CrawlJob) -> None:
+        """Запуск и менеджмент парсинга каталога или поиска"""
+        parser = self.parser
+        start_offset = 0
+        response_json = await asyncio.to_thread(parser._probe_page_limit, job)
+        job.page_limit = parser.page_limit
+        if response_json is None:
+            response_json = await self._get_page(job, start_offset)
+        if len(response_json["items"]) == 0 and response_json["processor"]["type"] in ("MENU_NODE", "COLLECTION"):
+            self.logger.debug("Редирект в каталог")
+            job.url = urljoin("https://megamarket.ru", response_json["processor"]["url"])
+            await asyncio.to_thread(parser.parse_input_url, job)
+            return await self._parse_multi_page(job)
+
+        # чтение контрольной точки дожидается записи очереди БД
+        window = await asyncio.to_thread(parser._plan_pages, job, response_json, start_offset)
+        # первая страница уже загружена, при ошибке разбора она загрузится заново
+        prefetched = {start_offset: response_json}
+        main_job = parser.rich_progress.add_task(f"[green]{job.job_name}", total=window.total)
+        # не больше `job.threads` страниц одновременно, чтобы url делили соединения поровну
+        tasks: dict[asyncio.Task, int] = {}
+        try:
+            while not window.done:
+                for page in window.next_pages(job.threads):
+                    tasks[asyncio.create_task(self._process_page(job, page, main_job, prefetched.pop(page, None)))] = page
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    page = tasks.pop(task)
+                    try:
+                        parse_next_page = task.result()
+                    except (asyncio.CancelledError, Exception):
+                        window.fail(page)
+                        continue
+                    stop = not parse_next_page and not window.stale(page)
+                    window.complete(page, parse_next_page)
+                    if stop:
+                        self.logger.info("Дальше товары не в наличии, их не парсим")
+                        parser.rich_progress.update(main_job, total=window.total)
+                        # страницы после последней с наличием прерываются, не дожидаясь ответа
+                        for other_task, other_page in tasks.items():
+                            if window.stale(other_page):
+                                other_task.cancel()
+        finally:
+            for task in tasks:
+                task.cancel()
+        window.checkpoint.clear()
@@ -0,0 +1,100 @@
+"""Кэши в памяти"""
+
+import concurrent.futures
+import threading
+from collections import OrderedDict
+from time import time
+from typing import Any, Callable, Hashable
+
+
+class LRUCache:
+    """Потокобезопасный LRU кэш с необязательным временем жизни записей"""
+
+    def __init__(self, maxsize: int = 10000, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at < time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def _expires_at(self, ttl: float | None) -> float:
+        ttl = self.ttl if ttl is None else ttl
+        return time() + ttl if ttl is not None else float("inf")
+
+    def _evict(self) -> None:
+        # в начале дольше всего не использованные записи, истекшие из них удаляются сразу, не дожидаясь get
+        current_time = time()
+        while self._data and next(iter(self._data.values()))[0] < current_time:
+            self._data.popitem(last=False)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        expires_at = self._expires_at(ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            self._evict()
+
+    def setdefault(self, key: Hashable, value: Any, ttl: float | None = None) -> Any:
+        """Сохранить значение, если ключа нет или он истек, вернуть актуальное значение"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] >= time():
+                self._data.move_to_end(key)
+                return entry[1]
+            self._data[key] = (self._expires_at(ttl), value)
+            self._data.move_to_end(key)
+            self._evict()
+            return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SingleFlight:
+    """Объединение одновременных вызовов с одинаковым ключом в один
+
+    Первый поток выполняет функцию, остальные ждут и получают тот же результат или исключение.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, concurrent.futures.Future] = {}
+
+    def do(self, key: Hashable, func: Callable, *args, **kwargs) -> Any:
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                self._calls[key] = future
+        if not leader:
+            return future.result()
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
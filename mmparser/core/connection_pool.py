@@ -0,0 +1,144 @@
+"""Планировщик соединений"""
+
+import heapq
+import itertools
+import random
+import threading
+from time import time
+from typing import Callable
+
+from .models import Connection
+
+
+class ConnectionPool:
+    """Куча свободных `Соединений`, упорядоченная по `usable_at`
+
+    Потоки блокируются на условной переменной, пока не освободится соединение,
+    возврат соединения в пул - O(log n). Из готовых к работе соединений
+    выбирается случайное с весом по `health_score`. Одно соединение выдается
+    одновременно не больше `per_connection_limit` раз. Асинхронный движок
+    занимает соединения через `try_acquire` и ждет возврата через `add_listener`.
+    """
+
+    def __init__(self, connections: list[Connection], per_connection_limit: int = 1):
+        self.connections: list[Connection] = list(connections)
+        self.per_connection_limit = max(1, per_connection_limit)
+        self._condition = threading.Condition()
+        self._counter = itertools.count()
+        self._heap: list[tuple[float, int, Connection]] = []
+        # номер действующей записи соединения в куче, остальные его записи устарели
+        self._entries: dict[Connection, int] = {}
+        self._in_flight: dict[Connection, int] = {connection: 0 for connection in self.connections}
+        self._listeners: list[Callable[[], None]] = []
+        for connection in self.connections:
+            self._push(connection)
+
+        self.acquire_count: int = 0
+        self.wait_time_total: float = 0.0
+        self.wait_time_max: float = 0.0
+
+    def _push(self, connection: Connection) -> None:
+        # Счетчик разрешает равные `usable_at` без сравнения самих соединений
+        count = next(self._counter)
+        self._entries[connection] = count
+        heapq.heappush(self._heap, (connection.usable_at, count, connection))
+
+    def _is_live(self, entry: tuple[float, int, Connection]) -> bool:
+        return self._entries.get(entry[2]) == entry[1]
+
+    def acquire(self) -> Connection:
+        """Дождаться и занять соединение с наименьшим `usable_at`"""
+        started_at = time()
+        with self._condition:
+            while True:
+                connection, wait_time = self._try_acquire(started_at)
+                if connection is not None:
+                    return connection
+                self._condition.wait(wait_time)
+
+    def try_acquire(self, started_at: float | None = None) -> tuple[Connection | None, float | None]:
+        """Занять готовое соединение без ожидания
+
+        Если готовых нет, возвращает None и сколько ждать ближайшего, None - пока не вернут занятое.
+        Время ожидания в статистике пула считается от `started_at`.
+        """
+        with self._condition:
+            return self._try_acquire(started_at or time())
+
+    def _try_acquire(self, started_at: float) -> tuple[Connection | None, float | None]:
+        while self._heap and not self._is_live(self._heap[0]):
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None, None
+        wait_time = self._heap[0][0] - time()
+        if wait_time > 0:
+            return None, wait_time
+        connection = self._pop_weighted()
+        self._in_flight[connection] += 1
+        connection.busy = True
+        if self._in_flight[connection] < self.per_connection_limit:
+            # соединение может взять еще запросы, не дожидаясь возврата
+            self._push(connection)
+            self._condition.notify()
+        else:
+            del self._entries[connection]
+        self._record_wait(time() - started_at)
+        return connection, 0.0
+
+    def _pop_weighted(self) -> Connection:
+        """Достать из кучи одно из готовых соединений с учетом их здоровья"""
+        current_time = time()
+        ready: list[Connection] = []
+        while self._heap and self._heap[0][0] <= current_time:
+            entry = heapq.heappop(self._heap)
+            if self._is_live(entry):
+                ready.append(entry[2])
+        if len(ready) == 1:
+            return ready[0]
+        connection = random.choices(ready, weights=[obj.health_score for obj in ready])[0]
+        for other in ready:
+            if other is not connection:
+                self._push(other)
+        return connection
+
+    def release(self, connection: Connection, usable_at: float) -> None:
+        """Вернуть соединение в пул, использовать его можно не раньше `usable_at`
+
+        Соединение на карантине вернется в работу для повторной проверки по его окончании.
+        """
+        with self._condition:
+            self._in_flight[connection] -= 1
+            connection.usable_at = max(usable_at, connection.quarantined_until)
+            connection.busy = self._in_flight[connection] > 0
+            self._push(connection)
+            self._condition.notify()
+        for listener in list(self._listeners):
+            listener()
+
+    def record_error(self, connection: Connection) -> bool:
+        """Учесть ошибку соединения, возвращает True, если оно ушло на карантин
+
+        Последнее соединение не на карантине туда не отправляется, иначе парсинг встанет целиком.
+        """
+        with self._condition:
+            others_usable = any(not other.quarantined for other in self.connections if other is not connection)
+            return connection.record_error(quarantine=others_usable)
+
+    def add_listener(self, listener: Callable[[], None]) -> None:
+        """Вызывать `listener` после каждого возврата соединения в пул"""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[], None]) -> None:
+        self._listeners.remove(listener)
+
+    def _record_wait(self, wait_time: float) -> None:
+        self.acquire_count += 1
+        self.wait_time_total += wait_time
+        self.wait_time_max = max(self.wait_time_max, wait_time)
+
+    @property
+    def wait_time_avg(self) -> float:
+        """Среднее время ожидания соединения"""
+        if not self.acquire_count:
+            return 0.0
+        return self.wait_time_total / self.acquire_count
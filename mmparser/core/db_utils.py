@@ -1,12 +1,164 @@
 import sqlite3
 import datetime
+import threading
+import queue
+import atexit
+import logging
+import json
+from time import time
 
 FILENAME = "storage.sqlite"
+MERCHANT_INN_TTL_DAYS = 30
+# сколько хранятся товары и уведомления, в секундах
+RETENTION = 86400
+
+# Запись в БД копится фоновым потоком и коммитится пачками
+BATCH_SIZE = 500
+BATCH_INTERVAL = 0.5  # секунды
+
+# Миграции схемы по версиям, текущая версия хранится в PRAGMA user_version
+MIGRATIONS = {
+    1: [
+        # дедупликация в add_to_db и поиск в get_last_notified
+        """CREATE INDEX IF NOT EXISTS idx_products_offer
+           ON products (goods_id, merchant_id, price, bonus_amount, scraped_at)""",
+        # delete_old_entries
+        "CREATE INDEX IF NOT EXISTS idx_products_scraped_at ON products (scraped_at)",
+    ],
+    2: [
+        # выборка неотправленных уведомлений
+        "CREATE INDEX IF NOT EXISTS idx_notifications_pending ON notifications (sent_at, next_attempt_at)",
+    ],
+}
+
+_FLUSH = object()
+_STOP = object()
+
+_connection: sqlite3.Connection | None = None
+_connection_lock = threading.Lock()
+_writer: "DbWriter | None" = None
+_writer_lock = threading.Lock()
+
+
+def connect() -> sqlite3.Connection:
+    """Открывает соединение с БД в режиме WAL"""
+    sqlite_connection = sqlite3.connect(FILENAME, check_same_thread=False)
+    sqlite_connection.execute("PRAGMA journal_mode=WAL")
+    sqlite_connection.execute("PRAGMA synchronous=NORMAL")
+    return sqlite_connection
+
+
+class DbWriter(threading.Thread):
+    """Фоновый поток записи в БД, коммитит по BATCH_SIZE запросов или раз в BATCH_INTERVAL"""
+
+    def __init__(self):
+        super().__init__(name="db-writer", daemon=True)
+        self.queue: queue.Queue = queue.Queue()
+        self.sqlite_connection = connect()
+        self.logger = logging.getLogger("rich")
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            batch = [item]
+            deadline = time() + BATCH_INTERVAL
+            while item not in (_FLUSH, _STOP) and len(batch) < BATCH_SIZE:
+                timeout = deadline - time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(item)
+            self._write([entry for entry in batch if entry not in (_FLUSH, _STOP)])
+            for _ in batch:
+                self.queue.task_done()
+            if item is _STOP:
+                self.sqlite_connection.close()
+                return
+
+    def _write(self, batch: list[tuple[str, tuple]]) -> None:
+        if not batch:
+            return
+        try:
+            with self.sqlite_connection:
+                for sql, params in batch:
+                    self.sqlite_connection.execute(sql, params)
+        except sqlite3.Error:
+            # пачка откатилась целиком, по одному запросу теряется только ошибочный
+            self.logger.warning("Ошибка записи пачки в БД, запись по одному запросу")
+            for sql, params in batch:
+                try:
+                    with self.sqlite_connection:
+                        self.sqlite_connection.execute(sql, params)
+                except sqlite3.Error:
+                    self.logger.exception("Ошибка записи в БД: %s", " ".join(sql.split()))
+
+
+def _get_writer() -> DbWriter:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = DbWriter()
+            _writer.start()
+        return _writer
+
+
+def _get_connection() -> sqlite3.Connection:
+    global _connection
+    if _connection is None:
+        _connection = connect()
+    return _connection
+
+
+def execute_write(sql: str, params: tuple = ()) -> None:
+    """Ставит запрос в очередь фоновой записи"""
+    _get_writer().queue.put((sql, params))
+
+
+def execute_read(sql: str, params: tuple = ()) -> list[tuple]:
+    """Выполняет запрос на чтение через общее соединение"""
+    with _connection_lock:
+        cursor = _get_connection().execute(sql, params)
+        rows = cursor.fetchall()
+        cursor.close()
+        return rows
+
+
+def execute_commit(sql: str, params: tuple = ()) -> int:
+    """Выполняет запрос на запись сразу, минуя очередь, возвращает число измененных строк"""
+    with _connection_lock:
+        sqlite_connection = _get_connection()
+        with sqlite_connection:
+            return sqlite_connection.execute(sql, params).rowcount
+
+
+def flush() -> None:
+    """Дожидается записи всех запросов из очереди"""
+    if _writer is None:
+        return
+    _writer.queue.put(_FLUSH)
+    _writer.queue.join()
+
+
+def close_db() -> None:
+    """Записывает очередь и закрывает соединения с БД"""
+    global _writer, _connection
+    with _writer_lock:
+        if _writer is not None:
+            _writer.queue.put(_STOP)
+            _writer.join()
+            _writer = None
+    with _connection_lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
 
 
 def create_db():
     """Создаёт таблицу products, если её нет"""
-    sqlite_connection = sqlite3.connect(FILENAME)
+    sqlite_connection = connect()
     cursor = sqlite_connection.cursor()
 
     cursor.execute("""
@@ -29,8 +181,55 @@ def create_db():
         );
     """)
 
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS merchants (
+            merchant_id         TEXT PRIMARY KEY,
+            inn                 TEXT,
+            updated_at          DATETIME
+        );
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS notifications (
+            id                  INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key     TEXT UNIQUE,
+            message             TEXT,
+            image_url           TEXT,
+            created_at          DATETIME,
+            attempts            INTEGER DEFAULT 0,
+            next_attempt_at     REAL,
+            sent_at             DATETIME
+        );
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS crawl_checkpoints (
+            url                 TEXT PRIMARY KEY,
+            sorting             INTEGER,
+            total               INTEGER,
+            page_limit          INTEGER,
+            completed_offsets   TEXT,
+            stop_offset         INTEGER,
+            updated_at          REAL
+        );
+    """)
+
     sqlite_connection.commit()
     cursor.close()
+    migrate_db(sqlite_connection)
+    sqlite_connection.close()
+
+
+def migrate_db(sqlite_connection: sqlite3.Connection) -> None:
+    """Применяет недостающие миграции схемы"""
+    schema_version = sqlite_connection.execute("PRAGMA user_version").fetchone()[0]
+    for version in sorted(MIGRATIONS):
+        if version <= schema_version:
+            continue
+        with sqlite_connection:
+            for sql in MIGRATIONS[version]:
+                sqlite_connection.execute(sql)
+            sqlite_connection.execute(f"PRAGMA user_version = {version}")
 
 
 def add_to_db(
@@ -52,63 +251,179 @@ def add_to_db(
 ):
 
     now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    sqlite_connection = sqlite3.connect(FILENAME)
-    cursor = sqlite_connection.cursor()
 
-    # Проверяем, есть ли уже этот товар в базе
-    cursor.execute("""
-        SELECT id FROM products 
+    # Вставляем, только если этого товара еще нет в базе
+    execute_write("""
+        INSERT INTO products
+        (goods_id, merchant_id, url, title, price, price_bonus, bonus_amount,
+        bonus_percent, available_quantity, delivery_date, merchant_name,
+        merchant_rating, scraped_at, notified)
+        SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+        WHERE NOT EXISTS (
+            SELECT 1 FROM products
+            WHERE goods_id = ? AND merchant_id = ? AND price = ? AND bonus_amount = ?
+        )
+    """, (
+        goods_id, merchant_id, url, title, price, price_bonus, bonus_amount,
+        bonus_percent, available_quantity, delivery_date, merchant_name,
+        merchant_rating, now, notified,
+        goods_id, merchant_id, price, bonus_amount,
+    ))
+
+
+def get_last_notified(goods_id, merchant_id, price, bonus_amount):
+    """Возвращает дату последнего уведомления по этому товару"""
+    rows = execute_read("""
+        SELECT scraped_at FROM products
         WHERE goods_id = ? AND merchant_id = ? AND price = ? AND bonus_amount = ?
+        ORDER BY scraped_at DESC
+        LIMIT 1
     """, (goods_id, merchant_id, price, bonus_amount))
 
-    existing_product = cursor.fetchone()
-
-    if not existing_product:
-        cursor.execute("""
-            INSERT INTO products 
-            (goods_id, merchant_id, url, title, price, price_bonus, bonus_amount, 
-            bonus_percent, available_quantity, delivery_date, merchant_name, 
-            merchant_rating, scraped_at, notified) 
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            goods_id, merchant_id, url, title, price, price_bonus, bonus_amount,
-            bonus_percent, available_quantity, delivery_date, merchant_name,
-            merchant_rating, now, notified
-        ))
+    return rows[0][0] if rows else None
 
-    sqlite_connection.commit()
-    cursor.close()
 
+def touch_offer(goods_id, merchant_id, price, bonus_amount):
+    """Обновляет время записи неизменившегося предложения, чтобы его не удалила очистка"""
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    execute_write(
+        "UPDATE products SET scraped_at = ? WHERE goods_id = ? AND merchant_id = ? AND price = ? AND bonus_amount = ?",
+        (now, goods_id, merchant_id, price, bonus_amount),
+    )
 
 
-def get_last_notified(goods_id, merchant_id, price, bonus_amount):
-    """Возвращает дату последнего уведомления по этому товару"""
-    sqlite_connection = sqlite3.connect(FILENAME)
-    cursor = sqlite_connection.cursor()
+def get_notify_state():
+    """Возвращает последнюю дату записи для каждого сочетания товар-продавец-цена-бонусы"""
+    return execute_read("""
+        SELECT goods_id, merchant_id, price, bonus_amount, MAX(scraped_at) FROM products
+        GROUP BY goods_id, merchant_id, price, bonus_amount
+    """)
 
-    cursor.execute("""
-        SELECT scraped_at FROM products 
-        WHERE goods_id = ? AND merchant_id = ? AND price = ? AND bonus_amount = ?
-        ORDER BY scraped_at DESC 
-        LIMIT 1
-    """, (goods_id, merchant_id, price, bonus_amount))
 
-    row = cursor.fetchone()
-    cursor.close()
-    print("KKKKK",goods_id, merchant_id, price, bonus_amount)
-    return row[0] if row else None
+def get_offer_snapshot():
+    """Возвращает последнее сохраненное состояние и время записи каждого предложения товар-продавец"""
+    # SQLite берет остальные столбцы из строки с MAX(scraped_at)
+    return execute_read("""
+        SELECT goods_id, merchant_id, price, bonus_amount, available_quantity, delivery_date, MAX(scraped_at)
+        FROM products
+        GROUP BY goods_id, merchant_id
+    """)
 
 
-def delete_old_entries():
-    """Удаляет товары старше 24 часов"""
-    sqlite_connection = sqlite3.connect(FILENAME)
-    cursor = sqlite_connection.cursor()
+def get_merchant_inn(merchant_id, max_age_days=MERCHANT_INN_TTL_DAYS):
+    """Возвращает сохраненный ИНН продавца, если он не старше max_age_days"""
+    min_updated_at = (datetime.datetime.now() - datetime.timedelta(days=max_age_days)).strftime("%Y-%m-%d %H:%M:%S")
 
-    one_day_ago = (datetime.datetime.now() - datetime.timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")
+    rows = execute_read("""
+        SELECT inn FROM merchants
+        WHERE merchant_id = ? AND updated_at >= ?
+    """, (merchant_id, min_updated_at))
 
-    cursor.execute("DELETE FROM products WHERE scraped_at < ?", (one_day_ago,))
-    sqlite_connection.commit()
-    cursor.close()
+    return rows[0][0] if rows else None
+
+
+def save_merchant_inn(merchant_id, inn):
+    """Сохраняет ИНН продавца"""
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    execute_write("""
+        INSERT OR REPLACE INTO merchants (merchant_id, inn, updated_at)
+        VALUES (?, ?, ?)
+    """, (merchant_id, inn, now))
+
+
+def add_notification(idempotency_key, message, image_url):
+    """Сохраняет уведомление в очередь отправки, повтор с тем же ключом игнорируется"""
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    return execute_commit("""
+        INSERT OR IGNORE INTO notifications (idempotency_key, message, image_url, created_at, attempts, next_attempt_at)
+        VALUES (?, ?, ?, ?, 0, 0)
+    """, (idempotency_key, message, image_url, now)) > 0
+
+
+def claim_notifications(limit, lease):
+    """Возвращает неотправленные уведомления, которым пора отправиться, и откладывает их на lease секунд
+
+    Если процесс упадет во время отправки, уведомления будут отправлены повторно по истечении lease.
+    """
+    now = time()
+    with _connection_lock:
+        sqlite_connection = _get_connection()
+        with sqlite_connection:
+            rows = sqlite_connection.execute("""
+                SELECT id, idempotency_key, message, image_url, attempts FROM notifications
+                WHERE sent_at IS NULL AND next_attempt_at <= ?
+                ORDER BY id
+                LIMIT ?
+            """, (now, limit)).fetchall()
+            sqlite_connection.executemany(
+                "UPDATE notifications SET next_attempt_at = ? WHERE id = ?",
+                [(now + lease, row[0]) for row in rows],
+            )
+    return rows
+
+
+def get_next_notification_time():
+    """Возвращает время ближайшей попытки отправки неотправленного уведомления"""
+    rows = execute_read("SELECT MIN(next_attempt_at) FROM notifications WHERE sent_at IS NULL")
+    return rows[0][0]
+
+
+def mark_notifications_sent(ids):
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with _connection_lock:
+        sqlite_connection = _get_connection()
+        with sqlite_connection:
+            sqlite_connection.executemany("UPDATE notifications SET sent_at = ? WHERE id = ?", [(now, id_) for id_ in ids])
+
+
+def reschedule_notification(id_, attempts, next_attempt_at):
+    execute_commit("UPDATE notifications SET attempts = ?, next_attempt_at = ? WHERE id = ?", (attempts, next_attempt_at, id_))
+
+
+def mark_notification_dead(id_, attempts):
+    """Больше не пытаться отправить уведомление, оно остается в БД до очистки"""
+    execute_commit("UPDATE notifications SET attempts = ?, next_attempt_at = NULL WHERE id = ?", (attempts, id_))
+
+
+def get_checkpoint(url, max_age):
+    """Возвращает (sorting, total, page_limit, completed_offsets, stop_offset) сохраненного прогресса url не старше max_age секунд"""
+    # прогресс пишется через очередь
+    flush()
+    rows = execute_read("""
+        SELECT sorting, total, page_limit, completed_offsets, stop_offset FROM crawl_checkpoints
+        WHERE url = ? AND updated_at >= ?
+    """, (url, time() - max_age))
+    if not rows:
+        return None
+    sorting, total, page_limit, completed_offsets, stop_offset = rows[0]
+    return sorting, total, page_limit, set(json.loads(completed_offsets)), stop_offset
+
+
+def save_checkpoint(url, sorting, total, page_limit, completed_offsets, stop_offset):
+    """Ставит прогресс парсинга url в очередь записи
+
+    Прогресс записывается после уже поставленных в очередь товаров страницы и не опережает их.
+    """
+    execute_write("""
+        INSERT OR REPLACE INTO crawl_checkpoints (url, sorting, total, page_limit, completed_offsets, stop_offset, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (url, sorting, total, page_limit, json.dumps(sorted(completed_offsets)), stop_offset, time()))
+
+
+def delete_checkpoint(url):
+    execute_write("DELETE FROM crawl_checkpoints WHERE url = ?", (url,))
+
+
+def delete_old_entries():
+    """Удаляет товары, отправленные и неотправляемые уведомления старше RETENTION"""
+    one_day_ago = (datetime.datetime.now() - datetime.timedelta(seconds=RETENTION)).strftime("%Y-%m-%d %H:%M:%S")
+
+    execute_write("DELETE FROM products WHERE scraped_at < ?", (one_day_ago,))
+    execute_write("DELETE FROM notifications WHERE sent_at < ?", (one_day_ago,))
+    execute_write("DELETE FROM notifications WHERE sent_at IS NULL AND next_attempt_at IS NULL AND created_at < ?", (one_day_ago,))
 
 
 create_db()
+atexit.register(close_db)
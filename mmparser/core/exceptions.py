@@ -8,3 +8,7 @@ class ConfigError(BaseException):
 
 class ApiError(BaseException):
     pass
+
+
+class ApiRejectedError(ApiError):
+    pass
@@ -9,6 +9,7 @@ from curl_cffi import requests
 from InquirerPy import inquirer
 
 from .parser_url import Parser_url
+from .models import CrawlJob
 from . import telegram, utils, exceptions
 
 console = Console()
@@ -56,9 +57,9 @@ def validate_url(url: str) -> bool:
     except Exception:
         return False
 
-    parser = Parser_url(url)
+    parser = Parser_url(url, [url])
     try:
-        parsed_url = parser.parse_input_url(tries=1)
+        parsed_url = parser.parse_input_url(CrawlJob(url), tries=1)
         if parsed_url:
             return parsed_url
         return False
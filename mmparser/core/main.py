@@ -36,6 +36,25 @@ def run_url_parser(args: argparse.Namespace, config: dict = {}) -> None:
         threads=config.get("threads") or args.threads,
         delay=config.get("delay") or args.delay,
         error_delay=config.get("error_delay") or args.error_delay,
+        checkpoint_ttl=config.get("checkpoint_ttl") or args.checkpoint_ttl,
+        min_delay=config.get("min_delay") or args.min_delay,
+        max_delay=config.get("max_delay") or args.max_delay,
+        engine=config.get("engine") or args.engine,
+        per_connection_limit=config.get("per_connection_limit") or args.per_connection_limit,
+        url_threads=config.get("url_threads") or args.url_threads,
+        refresh_interval=config.get("refresh_interval") or args.refresh_interval,
+        watch_margin=config.get("watch_margin") or args.watch_margin,
+        watch_interval=config.get("watch_interval") or args.watch_interval,
+        page_window=config.get("page_window") or args.page_window,
+        page_limit=config.get("page_limit") or args.page_limit,
+        request_cache_ttl=config.get("request_cache_ttl") if config.get("request_cache_ttl") is not None else args.request_cache_ttl,
+        api_base_url=config.get("api_url") or args.api_url,
+        cycles=config.get("cycles") or args.cycles,
+        record_dir=config.get("record") or args.record,
+        replay_dir=config.get("replay") or args.replay,
+        metrics_port=config.get("metrics_port") or args.metrics_port,
+        profile=config.get("profile") or args.profile,
+        profile_dir=config.get("profile_dir") or args.profile_dir,
         log_level=config.get("log_level") or args.log_level,
     )
     parser_instance.parse()
@@ -69,6 +88,25 @@ def main():
     parser.add_argument("-threads", type=int, help="Количество потоков. По умолчанию: 1 на каждое соединиение")
     parser.add_argument("-delay", type=float, help="Задержка между запросами в секундах при работе в одном потоке. По умолчанию: 1.8")
     parser.add_argument("-error-delay", type=float, help="Задержка между запосами в секундах в случае ошибки при работе в одном потоке. По умолчанию: 5")
+    parser.add_argument("-checkpoint-ttl", type=float, help="Продолжать прерванный парсинг url, если прогресс сохранен не раньше заданного времени, в минутах. По умолчанию: 60")
+    parser.add_argument("-min-delay", type=float, help="Минимальная задержка между запросами соединения при автоподстройке. По умолчанию: 0.5")
+    parser.add_argument("-max-delay", type=float, help="Максимальная задержка между запросами соединения при автоподстройке. По умолчанию: 30")
+    parser.add_argument("-engine", choices=["threads", "async"], default="threads", help="Движок парсинга страниц: потоки или asyncio. По умолчанию: threads")
+    parser.add_argument("-per-connection-limit", type=int, help="Сколько запросов движок async одновременно отправляет через одно соединение. По умолчанию: 1")
+    parser.add_argument("-url-threads", type=int, help="Сколько url парсить одновременно, потоки делятся между ними поровну. По умолчанию: 1")
+    parser.add_argument("-refresh-interval", type=float, help="Интервал повторного парсинга url, в минутах. Url без изменений парсятся реже. По умолчанию: 0")
+    parser.add_argument("-watch-margin", type=float, help="Часто перепроверять товары, которые не дотянули до порогов уведомлений не больше чем на заданную долю, например 0.1")
+    parser.add_argument("-watch-interval", type=float, help="Интервал перепроверки товаров из списка наблюдения, в минутах. По умолчанию: 1")
+    parser.add_argument("-page-window", type=int, help="Сколько страниц парсить наперед после последней страницы с товарами в наличии. По умолчанию: по числу потоков на url")
+    parser.add_argument("-page-limit", type=str, help="Товаров на странице каталога или поиска, число или auto для подбора наибольшего, который отдает api. По умолчанию: 44")
+    parser.add_argument("-request-cache-ttl", type=float, help="Сколько секунд переиспользовать ответ api на одинаковый запрос, например предложения товара из разных url. 0 - не кэшировать. По умолчанию: 30")
+    parser.add_argument("-api-url", type=str, help="Адрес api, например локального мока для тестов. По умолчанию: https://megamarket.ru/api/mobile/v1")
+    parser.add_argument("-cycles", type=int, help="Сколько проходов сделать и завершиться. По умолчанию: 0 - без ограничения")
+    parser.add_argument("-record", type=str, metavar="DIR", help="Сохранять ответы api в каталог для воспроизведения")
+    parser.add_argument("-replay", type=str, metavar="DIR", help="Брать ответы api из каталога записей, без сети и задержек")
+    parser.add_argument("-metrics-port", type=int, help="Отдавать метрики запросов к api в формате Prometheus на http://127.0.0.1:port/metrics")
+    parser.add_argument("-profile", choices=["cpu", "mem"], help="Профилировать каждый проход: cpu - cProfile в .pstats, mem - снимки tracemalloc. Число проходов задается -cycles")
+    parser.add_argument("-profile-dir", type=str, help="Каталог для профилей. По умолчанию: profiles")
     parser.add_argument("-log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], default="INFO", help="Уровень лога. По умолчанию: INFO")
     args = parser.parse_args()
 
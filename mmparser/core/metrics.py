@@ -0,0 +1,202 @@
+"""Метрики запросов к api: счетчики и гистограммы задержек по методам и соединениям"""
+
+import bisect
+import threading
+from dataclasses import dataclass, field
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from rich.console import Console
+from rich.table import Table
+
+# границы корзин гистограммы задержек, в секундах
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+OUTCOMES = ("ok", "rate_limited", "error", "exception")
+
+
+def api_method(api_url: str) -> str:
+    """Метод api из адреса, например catalogService/catalog/search"""
+    return urlparse(api_url).path.split("/v1/", 1)[-1].strip("/")
+
+
+@lru_cache(maxsize=1024)
+def connection_label(proxy_string: str | None) -> str:
+    """Имя соединения для метрик: прокси без пароля"""
+    if not proxy_string:
+        return "direct"
+    parsed = urlparse(proxy_string)
+    user = f"{parsed.username}@" if parsed.username else ""
+    return f"{parsed.scheme}://{user}{parsed.hostname}:{parsed.port}"
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        # последняя корзина - больше верхней границы
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def merge(self, other: "Histogram") -> None:
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля сверху, по границе корзины"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+@dataclass
+class RequestStats:
+    outcomes: dict[str, int] = field(default_factory=lambda: dict.fromkeys(OUTCOMES, 0))
+    retries: int = 0
+    bytes_received: int = 0
+    latency: Histogram = field(default_factory=Histogram)
+
+    @property
+    def requests(self) -> int:
+        return sum(self.outcomes.values())
+
+    def merge(self, other: "RequestStats") -> None:
+        for outcome, count in other.outcomes.items():
+            self.outcomes[outcome] += count
+        self.retries += other.retries
+        self.bytes_received += other.bytes_received
+        self.latency.merge(other.latency)
+
+
+class RequestMetrics:
+    """Статистика запросов к api по парам (метод, соединение)
+
+    Хранит накопленные значения для Prometheus и отдельно значения
+    текущего прохода для сводки в конце прохода.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total: dict[tuple[str, str], RequestStats] = {}
+        self.cycle: dict[tuple[str, str], RequestStats] = {}
+
+    def observe(self, api_url: str, proxy_string: str | None, latency: float, response, response_data: dict | None, retry: bool) -> None:
+        """Учесть попытку запроса, `response` None - исключение при запросе, `response_data` None - ответ не json"""
+        if response is None:
+            outcome = "exception"
+        elif response_data is None:
+            outcome = "error"
+        elif response.status_code == 200 and not response_data.get("error"):
+            outcome = "ok"
+        elif response.status_code == 200 and response_data.get("code") == 7:
+            outcome = "rate_limited"
+        else:
+            outcome = "error"
+        size = len(response.content or b"") if response is not None else 0
+        key = (api_method(api_url), connection_label(proxy_string))
+        with self.lock:
+            for stats_by_key in (self.total, self.cycle):
+                stats = stats_by_key.get(key)
+                if stats is None:
+                    stats = stats_by_key[key] = RequestStats()
+                stats.outcomes[outcome] += 1
+                stats.retries += retry
+                stats.bytes_received += size
+                stats.latency.observe(latency)
+
+    def take_cycle(self) -> dict[tuple[str, str], RequestStats]:
+        """Забрать статистику прохода и начать новую"""
+        with self.lock:
+            cycle, self.cycle = self.cycle, {}
+        return cycle
+
+    def render_prometheus(self) -> str:
+        """Накопленные метрики в текстовом формате Prometheus"""
+        with self.lock:
+            items = sorted(self.total.items())
+            lines = [
+                "# HELP mmparser_api_requests_total Попытки запросов к api по результату",
+                "# TYPE mmparser_api_requests_total counter",
+            ]
+            for (endpoint, connection), stats in items:
+                for outcome, count in stats.outcomes.items():
+                    lines.append(f'mmparser_api_requests_total{{endpoint="{endpoint}",connection="{connection}",outcome="{outcome}"}} {count}')
+            lines += ["# HELP mmparser_api_retries_total Повторные попытки запросов к api", "# TYPE mmparser_api_retries_total counter"]
+            for (endpoint, connection), stats in items:
+                lines.append(f'mmparser_api_retries_total{{endpoint="{endpoint}",connection="{connection}"}} {stats.retries}')
+            lines += ["# HELP mmparser_api_response_bytes_total Получено байт от api", "# TYPE mmparser_api_response_bytes_total counter"]
+            for (endpoint, connection), stats in items:
+                lines.append(f'mmparser_api_response_bytes_total{{endpoint="{endpoint}",connection="{connection}"}} {stats.bytes_received}')
+            lines += ["# HELP mmparser_api_request_duration_seconds Время попытки запроса к api", "# TYPE mmparser_api_request_duration_seconds histogram"]
+            for (endpoint, connection), stats in items:
+                labels = f'endpoint="{endpoint}",connection="{connection}"'
+                cumulative = 0
+                for bound, count in zip((*stats.latency.buckets, "+Inf"), stats.latency.counts):
+                    cumulative += count
+                    lines.append(f'mmparser_api_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"mmparser_api_request_duration_seconds_sum{{{labels}}} {stats.latency.sum:.6f}")
+                lines.append(f"mmparser_api_request_duration_seconds_count{{{labels}}} {stats.latency.count}")
+        return "\n".join(lines) + "\n"
+
+    def print_summary(self, stats_by_key: dict[tuple[str, str], RequestStats], by_connection: bool = False) -> None:
+        """Сводная таблица запросов прохода по методам api, и по соединениям при `by_connection`"""
+        groups = [("Метод api", 0)] + ([("Соединение", 1)] if by_connection else [])
+        for title, index in groups:
+            grouped: dict[str, RequestStats] = {}
+            for key, stats in stats_by_key.items():
+                grouped.setdefault(key[index], RequestStats()).merge(stats)
+            table = Table(title=f"Запросы к api за проход: {title.lower()}")
+            table.add_column(title)
+            for column in ("запросов", "повторов", "code 7", "ошибок", "исключений", "КБ", "p50 с", "p95 с", "макс с"):
+                table.add_column(column, justify="right")
+            for name, stats in sorted(grouped.items()):
+                table.add_row(
+                    name,
+                    str(stats.requests),
+                    str(stats.retries),
+                    str(stats.outcomes["rate_limited"]),
+                    str(stats.outcomes["error"]),
+                    str(stats.outcomes["exception"]),
+                    f"{stats.bytes_received / 1024:.0f}",
+                    f"{stats.latency.quantile(0.5):.3f}",
+                    f"{stats.latency.quantile(0.95):.3f}",
+                    f"{stats.latency.max:.3f}",
+                )
+            Console().print(table)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        data = self.server.metrics.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(metrics: RequestMetrics, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Отдавать метрики в формате Prometheus на http://host:port/metrics в фоновом потоке"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -1,6 +1,11 @@
+import threading
+from datetime import datetime
+from time import time
 from dataclasses import dataclass, field
 from typing import Optional
 
+from curl_cffi import requests, CurlInfo
+
 
 @dataclass
 class ParsedOffer:
@@ -26,8 +31,160 @@ class ParsedOffer:
         return int((self.bonus_amount / self.price) * 100)
 
 
+@dataclass
+class CrawlJob:
+    """Состояние парсинга одного url за проход"""
+
+    url: str
+    job_name: str = ""
+    threads: int = 1
+    page_limit: int = 0
+    parsed_url: Optional[dict] = field(default=None)
+    start_time: Optional[datetime] = field(default=None)
+    job_id: Optional[int] = field(default=None)
+    scraped_items_counter: int = 0
+    changed_offers_counter: int = 0
+    failed: bool = False
+
+
+class RateController:
+    """AIMD регулятор задержки между запросами соединения
+
+    Задержка уменьшается на `step` после серии успешных ответов
+    и умножается на `factor` при ответе api "слишком частые запросы".
+    """
+
+    SUCCESS_STREAK = 10
+
+    def __init__(self, delay: float, min_delay: float, max_delay: float, step: float = 0.1, factor: float = 2.0):
+        self.min_delay = min_delay
+        self.max_delay = max(max_delay, min_delay)
+        self.delay = min(max(delay, self.min_delay), self.max_delay)
+        self.step = step
+        self.factor = factor
+        self.success_streak: int = 0
+
+    def on_success(self) -> None:
+        self.success_streak += 1
+        if self.success_streak >= self.SUCCESS_STREAK:
+            self.success_streak = 0
+            self.delay = max(self.min_delay, self.delay - self.step)
+
+    def on_rate_limit(self) -> None:
+        self.success_streak = 0
+        self.delay = min(self.max_delay, self.delay * self.factor)
+
+
 class Connection:
+    # Сглаживание EWMA задержки и доли ошибок
+    HEALTH_ALPHA = 0.2
+    # Ошибок подряд до карантина
+    QUARANTINE_ERRORS = 3
+    QUARANTINE_BASE_DELAY = 30.0
+    QUARANTINE_MAX_DELAY = 900.0
+
     def __init__(self, proxy: str | None):
         self.proxy_string: str | None = proxy
         self.usable_at: int = 0
         self.busy = False
+        self.session: requests.Session | None = None
+        self.session_lock = threading.Lock()
+        self.requests_count: int = 0
+        self.handshakes_count: int = 0
+
+        self.latency_ewma: float = 0.0
+        self.error_rate: float = 0.0
+        self.errors_count: int = 0
+        self.rate_limited_count: int = 0
+        self.consecutive_errors: int = 0
+        self.quarantine_count: int = 0
+        self.quarantined_until: float = 0.0
+
+        self.rate = RateController(delay=1.8, min_delay=1.8, max_delay=1.8)
+
+    @property
+    def reused_count(self) -> int:
+        """Количество запросов, выполненных без нового TCP+TLS рукопожатия"""
+        return self.requests_count - self.handshakes_count
+
+    @property
+    def health_score(self) -> float:
+        """Вес соединения при выборе: ниже при ошибках и высокой задержке"""
+        return max(0.01, (1 - self.error_rate) / (1 + self.latency_ewma))
+
+    @property
+    def quarantined(self) -> bool:
+        return self.quarantined_until > time()
+
+    def _update_latency(self, latency: float) -> None:
+        if self.latency_ewma:
+            self.latency_ewma += self.HEALTH_ALPHA * (latency - self.latency_ewma)
+        else:
+            self.latency_ewma = latency
+
+    def record_success(self, latency: float) -> None:
+        """Учесть успешный ответ api"""
+        self._update_latency(latency)
+        self.error_rate *= 1 - self.HEALTH_ALPHA
+        self.consecutive_errors = 0
+        self.quarantine_count = 0
+        self.rate.on_success()
+
+    def record_rate_limit(self, latency: float) -> None:
+        """Учесть ответ api "слишком частые запросы" (code 7)"""
+        self._update_latency(latency)
+        self.rate_limited_count += 1
+        self.rate.on_rate_limit()
+
+    def record_error(self, quarantine: bool = True) -> bool:
+        """Учесть ошибку соединения, возвращает True, если соединение ушло на карантин
+
+        С `quarantine=False` ошибка учитывается, но карантин откладывается до следующей ошибки.
+        """
+        self.errors_count += 1
+        self.error_rate += self.HEALTH_ALPHA * (1 - self.error_rate)
+        self.consecutive_errors += 1
+        # после карантина соединение на испытательном сроке, достаточно одной ошибки
+        if self.consecutive_errors < self.QUARANTINE_ERRORS and not self.quarantine_count:
+            return False
+        if not quarantine:
+            return False
+        quarantine_delay = min(self.QUARANTINE_MAX_DELAY, self.QUARANTINE_BASE_DELAY * 2**self.quarantine_count)
+        self.quarantine_count += 1
+        self.consecutive_errors = 0
+        self.quarantined_until = time() + quarantine_delay
+        return True
+
+    def _get_session(self) -> requests.Session:
+        """Получить постоянную keep-alive сессию соединения"""
+        if self.session is None:
+            # Соединение используется одним потоком за раз, поэтому curl хэндл общий,
+            # иначе для каждого потока создавался бы свой пул соединений
+            self.session = requests.Session(
+                proxy=self.proxy_string,
+                verify=False,
+                impersonate="chrome120",
+                http_version="v2tls",
+                use_thread_local_curl=False,
+                curl_infos=[CurlInfo.NUM_CONNECTS],
+            )
+        return self.session
+
+    def post(self, url: str, json_data: dict) -> requests.Response:
+        """POST запрос через сессию соединения"""
+        with self.session_lock:
+            response = self._get_session().post(url, json=json_data)
+            self.record_request(response)
+        return response
+
+    def record_request(self, response: requests.Response) -> None:
+        """Учесть выполненный запрос и новые рукопожатия по NUM_CONNECTS из ответа"""
+        self.requests_count += 1
+        self.handshakes_count += response.infos.get(CurlInfo.NUM_CONNECTS, 0)
+
+    def close(self) -> None:
+        """Закрыть сессию соединения"""
+        with self.session_lock:
+            if self.session is not None:
+                self.session.close()
+                self.session = None
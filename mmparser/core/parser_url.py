@@ -1,12 +1,15 @@
 """mmparser"""
 
+import bisect
 import logging
 from datetime import datetime
+import html
 import random
 import string
 from time import sleep, time
 import threading
 import concurrent.futures
+import asyncio
 import sys
 import json
 import signal
@@ -15,19 +18,149 @@ from urllib.parse import urlparse, parse_qsl, parse_qs, unquote, urljoin
 
 from rich.progress import BarColumn, Progress, SpinnerColumn, TextColumn, TimeRemainingColumn
 from rich.logging import RichHandler
-from curl_cffi import requests
 
-from .models import ParsedOffer, Connection
-from .exceptions import ConfigError, ApiError
+from .models import ParsedOffer, Connection, CrawlJob, RateController
+from .connection_pool import ConnectionPool
+from .cache import LRUCache, SingleFlight
+from .exceptions import ConfigError, ApiError, ApiRejectedError
 from . import db_utils, utils
 from .telegram import TelegramClient, validate_tg_credentials
+from .async_engine import AsyncCrawler
+from .scheduler import CrawlScheduler
+from .watchlist import Watchlist
+from .recorder import ApiRecorder
+from .metrics import RequestMetrics, api_method, start_metrics_server
+from .profiling import CycleProfiler
+
+API_BASE_URL = "https://megamarket.ru/api/mobile/v1"
+NOTIFY_STATE_TTL = 86400
+# сколько наблюдать за товаром после последнего попадания в список наблюдения
+WATCHLIST_TTL = 3600
+PAGE_LIMIT_DEFAULT = 44
+REQUEST_CACHE_TTL = 30
+# время записи неизменившегося предложения обновляется в БД, пока запись не удалена очисткой
+OFFER_REFRESH_AGE = db_utils.RETENTION / 2
+REQUEST_CACHE_SIZE = 5000
+# ответы, которые повторяются между url и потоками. Страницы каталога у каждого url свои
+# и только вытесняли бы из кэша полезные записи
+CACHED_API_METHODS = frozenset({
+    "catalogService/productOffers/get",
+    "partnerService/merchant/legalInfo/get",
+    "urlService/url/parse",
+})
+# размеры страницы, которые пробуются по убыванию при -page-limit auto
+PAGE_LIMIT_CANDIDATES = (200, 100, 88)
+# попыток запроса размера страницы при ошибках соединения и лимите запросов
+PAGE_LIMIT_PROBE_TRIES = 3
+
+
+class CrawlCheckpoint:
+    """Прогресс парсинга одного url: спаршенные смещения и страница, после которой товаров нет в наличии"""
+
+    def __init__(self, url: str, sorting: int, total: int, page_limit: int):
+        self.url = url
+        self.sorting = sorting
+        self.total = total
+        self.page_limit = page_limit
+        self.completed_offsets: set[int] = set()
+        self.stop_offset: int | None = None
+        self.lock = threading.Lock()
+
+    def restore(self, max_age: float) -> bool:
+        """Восстановить прогресс из БД, если он свежий и выдача не изменилась"""
+        saved = db_utils.get_checkpoint(self.url, max_age)
+        if not saved:
+            return False
+        sorting, total, page_limit, completed_offsets, stop_offset = saved
+        if (sorting, total, page_limit) != (self.sorting, self.total, self.page_limit):
+            return False
+        self.completed_offsets = completed_offsets
+        self.stop_offset = stop_offset
+        return True
+
+    def pending(self, offsets: list[int]) -> list[int]:
+        """Смещения, которые осталось спарсить"""
+        return [
+            offset
+            for offset in offsets
+            if offset not in self.completed_offsets and (self.stop_offset is None or offset <= self.stop_offset)
+        ]
+
+    def complete(self, offset: int, parse_next_page: bool) -> None:
+        with self.lock:
+            self.completed_offsets.add(offset)
+            if not parse_next_page and (self.stop_offset is None or offset < self.stop_offset):
+                self.stop_offset = offset
+            db_utils.save_checkpoint(self.url, self.sorting, self.total, self.page_limit, self.completed_offsets, self.stop_offset)
+
+    def clear(self) -> None:
+        db_utils.delete_checkpoint(self.url)
+
+
+class PageWindow:
+    """Выдача страниц на парсинг окном
+
+    В работе не больше `size` страниц дальше последней страницы, где товары еще в наличии,
+    чтобы после страницы без наличия не грузить и не разбирать лишние.
+    """
+
+    def __init__(self, checkpoint: CrawlCheckpoint, pages: list[int], page_limit: int, size: int, confirmed_offset: int):
+        self.checkpoint = checkpoint
+        self.pending = sorted(pages)
+        self.page_limit = page_limit
+        self.size = size
+        self.confirmed_offset = max([confirmed_offset, *checkpoint.completed_offsets])
+        self.in_flight: set[int] = set()
+        self.pages_count = len(self.pending)
+        self.dropped_pages: set[int] = set()
+
+    @property
+    def total(self) -> int:
+        """Сколько страниц будет спаршено"""
+        return self.pages_count - len(self.dropped_pages)
+
+    @property
+    def done(self) -> bool:
+        return not self.pending and not self.in_flight
+
+    def next_pages(self, max_in_flight: int) -> list[int]:
+        """Страницы, которые можно начать парсить сейчас"""
+        pages = []
+        while self.pending and len(self.in_flight) < max_in_flight:
+            if self.in_flight and self.pending[0] > self.confirmed_offset + self.size * self.page_limit:
+                break
+            page = self.pending.pop(0)
+            self.in_flight.add(page)
+            pages.append(page)
+        return pages
+
+    def stale(self, page: int) -> bool:
+        """Страница после страницы, где товары закончились"""
+        return self.checkpoint.stop_offset is not None and page > self.checkpoint.stop_offset
+
+    def complete(self, page: int, parse_next_page: bool) -> None:
+        self.in_flight.discard(page)
+        if self.stale(page):
+            return
+        self.checkpoint.complete(page, parse_next_page)
+        if parse_next_page:
+            self.confirmed_offset = max(self.confirmed_offset, page)
+            return
+        self.dropped_pages.update(offset for offset in (*self.pending, *self.in_flight) if offset > page)
+        self.pending = [offset for offset in self.pending if offset < page]
+
+    def fail(self, page: int) -> None:
+        """Вернуть страницу в очередь после ошибки"""
+        self.in_flight.discard(page)
+        if not self.stale(page):
+            bisect.insort(self.pending, page)
 
 
 class Parser_url:
     def __init__(
         self,
         url: str,
-        urls: list[str],
+        urls: list[str | dict],
         categories_path: str = "",
         job_name: str = "",
         include: str = "",
@@ -52,6 +185,25 @@ class Parser_url:
         threads: int = None,
         delay: float = None,
         error_delay: float = None,
+        checkpoint_ttl: float = None,
+        min_delay: float = None,
+        max_delay: float = None,
+        engine: str = "threads",
+        per_connection_limit: int = None,
+        url_threads: int = None,
+        refresh_interval: float = None,
+        watch_margin: float = None,
+        watch_interval: float = None,
+        page_window: int = None,
+        page_limit: int | str = None,
+        request_cache_ttl: float = None,
+        api_base_url: str = "",
+        cycles: int = None,
+        record_dir: str = "",
+        replay_dir: str = "",
+        metrics_port: int = None,
+        profile: str = "",
+        profile_dir: str = "",
         log_level: str = "INFO",
     ):
         self.cookie_file_path = cookie_file_path
@@ -62,25 +214,55 @@ class Parser_url:
         self.tg_config = tg_config
         self.connection_success_delay = delay or 1.8
         self.connection_error_delay = error_delay or 10.0
+        self.connection_min_delay = min_delay or 0.5
+        self.connection_max_delay = max_delay or 30.0
         self.log_level = log_level
-
-        self.start_time: datetime = None
+        self.engine = engine
+        self.per_connection_limit = per_connection_limit or 1
+        self.checkpoint_ttl = checkpoint_ttl or 60
+        self.url_threads = url_threads or 1
+        self.refresh_interval = refresh_interval or 0
+        self.scheduler: CrawlScheduler = None
+        self.watch_margin = watch_margin or 0
+        self.watch_interval = watch_interval or 1
+        self.watchlist: Watchlist = None
+        self.page_window = page_window
+        self.page_limit_config = page_limit
+        self.page_limit: int = PAGE_LIMIT_DEFAULT
+        self.page_limit_probe = False
+        self.page_limit_lock = threading.Lock()
+        self.request_cache_ttl = REQUEST_CACHE_TTL if request_cache_ttl is None else request_cache_ttl
+        # (адрес api, тело запроса) -> ответ в json, одинаковые запросы разных url и потоков выполняются один раз
+        self.request_cache = LRUCache(maxsize=REQUEST_CACHE_SIZE, ttl=self.request_cache_ttl)
+        self.request_flight = SingleFlight()
+        self.request_cache_hits = 0
+        self.api_base_url = (api_base_url or API_BASE_URL).rstrip("/")
+        self.cycles = cycles or 0
+        self.record_dir = record_dir
+        self.replay_dir = replay_dir
+        self.recorder: ApiRecorder = None
+        self.metrics_port = metrics_port
+        self.metrics = RequestMetrics()
+        self.profile_mode = profile
+        self.profile_dir = profile_dir or "profiles"
+        self.profiler: CycleProfiler = None
 
         self.region_id = "50"
         self.session = None
         self.connections: list[Connection] = []
+        self.pool: ConnectionPool = None
+        self.offers_executor: concurrent.futures.ThreadPoolExecutor = None
         self.parsed_proxies: set | None = None
         self.categories: dict = None
         self.cookie_dict: dict = None
         self.profile: dict = {}
         self.rich_progress = None
-        self.job_name: str = ""
 
         self.logger: logging.Logger = self._create_logger(self.log_level)
         self.tg_client: TelegramClient = None
 
         self.url: str = url
-        self.urls: list[str] = urls
+        self.urls: list[str | dict] = urls
         self.job_name: str = job_name
         self.include: str = include
         self.exclude: str = exclude
@@ -92,6 +274,11 @@ class Parser_url:
         self.account_alert: bool = account_alert
         self.use_merchant_blacklist: bool = use_merchant_blacklist
         self.merchant_blacklist: list = utils.load_blacklist() if use_merchant_blacklist else []
+        # ИНН в памяти живет столько же, сколько в БД, чтобы смена ИНН продавца подхватывалась без перезапуска
+        self.merchant_inn_cache = LRUCache(maxsize=10000, ttl=db_utils.MERCHANT_INN_TTL_DAYS * 86400)
+        self.merchant_inn_flight = SingleFlight()
+        # (goods_id, merchant_id, price, bonus_amount) -> время первой записи в БД
+        self.notify_state = LRUCache(maxsize=1_000_000, ttl=NOTIFY_STATE_TTL)
         self.price_min_value_alert: float = price_min_value_alert or float("-inf")
         self.price_value_alert: float = price_value_alert or float("inf")
         self.price_bonus_value_alert: float = price_bonus_value_alert or float("inf")
@@ -102,10 +289,9 @@ class Parser_url:
         self.threads: int = threads
 
         self.blacklist: list = []
-        self.parsed_url: dict = None
-        self.scraped_tems_counter: int = 0
+        # (goods_id, merchant_id) -> (хэш цены, бонусов, количества и даты доставки, время записи в БД)
+        self.offer_snapshot: dict[tuple[str, str], tuple[int, float]] = {}
         self.rich_progress = None
-        self.job_id: int = None
 
         self.address_id: str = None
         self.lock = threading.Lock()
@@ -143,21 +329,17 @@ class Parser_url:
             self.connections.append(Connection(None))
         elif not self.connections:
             self.connections = [Connection(None)]
+        for connection in self.connections:
+            connection.rate = RateController(self.connection_success_delay, self.connection_min_delay, self.connection_max_delay)
+        # синхронная сессия соединения выполняет запросы по одному, несколько запросов сразу мультиплексирует только async
+        self.pool = ConnectionPool(self.connections, self.per_connection_limit if self.engine == "async" else 1)
 
-    def _get_connection(self) -> str:
+    def _get_connection(self) -> Connection:
         """Получить самое позднее использованное `Соединение`"""
-        while True:
-            free_proxies = [proxy for proxy in self.connections if not proxy.busy]
-            if free_proxies:
-                oldest_proxy = min(free_proxies, key=lambda obj: obj.usable_at)
-                current_time = time()
-                if oldest_proxy.usable_at <= current_time:
-                    return oldest_proxy
-                sleep(oldest_proxy.usable_at - time())
-                return self._get_connection()
-            # No free proxies, wait and retry
-
-    def _api_request(self, api_url: str, json_data: dict, tries: int = 10, delay: float = 0) -> dict:
+        return self.pool.acquire()
+
+    def _add_auth(self, json_data: dict) -> dict:
+        """Добавить в тело запроса данные авторизации api"""
         json_data["auth"] = {
             "locationId": self.region_id,
             "appPlatform": "WEB",
@@ -165,31 +347,109 @@ class Parser_url:
             "experiments": {},
             "os": "UNKNOWN_OS",
         }
+        return json_data
+
+    def _api_url(self, method: str) -> str:
+        """Адрес метода api с учетом -api-url"""
+        return f"{self.api_base_url}/{method}"
+
+    def _request_key(self, api_url: str, json_data: dict) -> tuple[str, str]:
+        """Ключ запроса: адрес api и тело в каноническом виде"""
+        return api_url, json.dumps(json_data, sort_keys=True, ensure_ascii=False)
+
+    def _is_cached(self, api_url: str) -> bool:
+        """Кэшируются ли ответы метода api"""
+        return bool(self.request_cache_ttl) and api_method(api_url) in CACHED_API_METHODS
+
+    def _api_request(self, api_url: str, json_data: dict, tries: int = 10, delay: float = 0, cache: bool = True) -> dict:
+        """Запрос к api, одинаковые одновременные запросы объединяются, ответы кэшируются на `request_cache_ttl` секунд"""
+        self._add_auth(json_data)
+        if not cache or not self._is_cached(api_url):
+            return self._send_api_request(api_url, json_data, tries, delay)
+        key = self._request_key(api_url, json_data)
+        response_text = self.request_cache.get(key)
+        if response_text is None:
+            response_text = self.request_flight.do(key, self._cached_api_request, key, api_url, json_data, tries, delay)
+        else:
+            self.request_cache_hits += 1
+        # ответ общий для всех вызовов, а разбор может его менять, json.loads дешевле deepcopy
+        return json.loads(response_text)
+
+    def _cached_api_request(self, key: tuple[str, str], api_url: str, json_data: dict, tries: int, delay: float) -> str:
+        response_text = json.dumps(self._send_api_request(api_url, json_data, tries, delay), ensure_ascii=False)
+        self.request_cache.set(key, response_text)
+        return response_text
+
+    @staticmethod
+    def _response_data(response) -> dict | None:
+        """Тело ответа api, None - запрос не выполнен или ответ не json"""
+        if response is None:
+            return None
+        try:
+            return response.json()
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _is_connection_error(response) -> bool:
+        """Ошибка соединения, а не ответ api: исключение при запросе или 5xx"""
+        return response is None or response.status_code >= 500
+
+    def _send_api_request(self, api_url: str, json_data: dict, tries: int, delay: float) -> dict:
+        if self.recorder is not None and self.recorder.replay:
+            return self.recorder.load(api_url, json_data)
         for i in range(0, tries):
+            rejected = False
             proxy: Connection = self._get_connection()
-            proxy.busy = True
             self.logger.debug("Прокси : %s", proxy.proxy_string)
+            # по умолчанию соединение отдыхает перед следующей попыткой
+            usable_at = time() + 1 * i
+            request_started_at = time()
             try:
-                response = requests.post(api_url, json=json_data, proxy=proxy.proxy_string, verify=False, impersonate="chrome120")
-                response_data: dict = response.json()
+                response = proxy.post(api_url, json_data)
             except Exception:
                 response = None
-            if response and response.status_code == 200 and not response_data.get("error"):
-                proxy.usable_at = time() + delay
-                proxy.busy = False
-                return response_data
-            if response and response.status_code == 200 and response_data.get("code") == 7:
-                self.logger.debug("Соединение %s: слишком частые запросы", proxy.proxy_string)
-                proxy.usable_at = time() + self.connection_error_delay
-            else:
-                sleep(1 * i)
-            proxy.busy = False
+            response_data = self._response_data(response)
+            latency = time() - request_started_at
+            self.metrics.observe(api_url, proxy.proxy_string, latency, response, response_data, retry=i > 0)
+            try:
+                if response_data is not None and response.status_code == 200 and not response_data.get("error"):
+                    proxy.record_success(latency)
+                    usable_at = time() + self._request_delay(proxy, delay)
+                    if self.recorder is not None:
+                        self.recorder.save(api_url, json_data, response_data)
+                    return response_data
+                if response_data is not None and response.status_code == 200 and response_data.get("code") == 7:
+                    self.logger.debug("Соединение %s: слишком частые запросы", proxy.proxy_string)
+                    proxy.record_rate_limit(latency)
+                    usable_at = time() + self.connection_error_delay
+                elif self._is_connection_error(response):
+                    if self.pool.record_error(proxy):
+                        self._log_quarantine(proxy)
+                elif response_data is not None:
+                    # ошибки api в ответе 200 и 4xx не говорят о проблеме с соединением
+                    rejected = True
+            finally:
+                self.pool.release(proxy, usable_at)
 
+        if rejected:
+            raise ApiRejectedError("Api отклонил запрос")
         raise ApiError("Ошибка получения данных api")
 
+    def _request_delay(self, connection: Connection, delay: float) -> float:
+        """Задержка соединения после успешного запроса, для регулируемых запросов - по AIMD"""
+        return connection.rate.delay if delay else 0
+
+    def _log_quarantine(self, connection: Connection) -> None:
+        self.logger.warning(
+            "Соединение %s на карантине %.0f с",
+            connection.proxy_string,
+            connection.quarantined_until - time(),
+        )
+
     def _get_profile(self) -> None:
         """Получить и сохранить информацию профиля ММ"""
-        response_json = self._api_request("https://megamarket.ru/api/mobile/v1/securityService/profile/get", json_data={})
+        response_json = self._api_request(self._api_url("securityService/profile/get"), json_data={})
         self.profile = response_json["profile"]
 
     def _set_up(self) -> None:
@@ -215,88 +475,233 @@ class Parser_url:
         if self.blacklist_path:
             self._read_blacklist_file()
         self.threads = self.threads or len(self.connections)
+        self.offers_executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.connections), thread_name_prefix="offers")
+        if self.engine not in ("threads", "async"):
+            raise ConfigError(f"Неизвестный движок {self.engine}!")
+        if self.watch_margin:
+            if not 0 < self.watch_margin < 1:
+                raise ConfigError(f"Запас наблюдения {self.watch_margin} должен быть между 0 и 1!")
+            self.watchlist = Watchlist(self.watch_interval * 60, WATCHLIST_TTL)
+        if self.record_dir and self.replay_dir:
+            raise ConfigError("Нельзя одновременно записывать и воспроизводить ответы api!")
+        if self.record_dir or self.replay_dir:
+            self.recorder = ApiRecorder(self.replay_dir or self.record_dir, replay=bool(self.replay_dir))
+        if self.profile_mode:
+            self.profiler = CycleProfiler(self.profile_mode, self.profile_dir, self.logger)
+        if self.page_limit_config == "auto":
+            self.page_limit_probe = True
+        elif self.page_limit_config:
+            try:
+                self.page_limit = int(self.page_limit_config)
+            except ValueError as exc:
+                raise ConfigError(f"Неверный размер страницы {self.page_limit_config}!") from exc
         if not Path(db_utils.FILENAME).exists():
             db_utils.create_db()
+        self._load_notify_state()
+        self._load_offer_snapshot()
+        # ограниченное число проходов и воспроизведение записей нужны для замеров, отсрочка url их только растягивает
+        backoff = not self.cycles and not self.replay_dir
+        self.scheduler = CrawlScheduler(self.urls or [self.url], self.refresh_interval, backoff=backoff)
 
     def parse(self) -> None:
         """Метод запуска парсинга"""
-        utils.check_for_new_version()
+        # с моком api или записанными ответами парсер работает без сети, GitHub не нужен
+        if self.api_base_url == API_BASE_URL and not self.replay_dir:
+            utils.check_for_new_version()
         if self.address:
             self._get_address_from_string(self.address)
-        while True:
+        self.logger.info("Потоков: %s, url одновременно: %s", self.threads, min(self.url_threads, len(self.scheduler.entries)))
+        if self.metrics_port:
+            start_metrics_server(self.metrics, self.metrics_port)
+            self.logger.info("Метрики: http://127.0.0.1:%s/metrics", self.metrics_port)
+        watch_thread = None
+        if self.watchlist is not None:
+            watch_thread = threading.Thread(target=self._watch_loop, name="watchlist", daemon=True)
+            watch_thread.start()
+        cycle = 0
+        while not self.cycles or cycle < self.cycles:
+            due = self.scheduler.due()
+            if not due:
+                wait_time = self.scheduler.wait_time()
+                self.logger.info("Следующий парсинг через %.0f с", wait_time)
+                sleep(wait_time)
+                continue
+            if self.profiler is not None:
+                self.profiler.start_cycle()
             db_utils.delete_old_entries()
-            for single_url in self.urls:
-                self.url = single_url
-                self.start_time = datetime.now()
-                self.logger.info("Целевой URL: %s", self.url)
-                self.logger.info("Потоков: %s", self.threads)
-                self._single_url()
-
-    def _single_url(self):
-        self.parse_input_url()
-        if self.parsed_url and not self.job_name:
-            search_text = self.parsed_url.get("searchText", {})
-            collection_title = (self.parsed_url.get("collection", {}) or {}).get("title")
-            merchant = (self.parsed_url.get("merchant", {}) or {}).get("slug")
-            unknown = "Не_определено"
-            self.job_name = search_text or collection_title or merchant or unknown
-            self.job_name = utils.slugify(self.job_name)
-        if self.parsed_url["type"] == "TYPE_PRODUCT_CARD":
-            self._parse_card()
-            self.logger.info("%s %s", self.job_name, self.start_time.strftime("%d-%m-%Y %H:%M:%S"))
+            self._prune_offer_snapshot()
+            # потоки страниц делятся между одновременно парсящимися url поровну
+            url_threads = min(self.url_threads, len(due))
+            jobs = [
+                CrawlJob(entry.url, job_name=entry.job_name or self.job_name, threads=max(1, self.threads // url_threads))
+                for entry in due
+            ]
+            self._create_progress_bar()
+            try:
+                if self.engine == "async":
+                    asyncio.run(AsyncCrawler(self).parse_jobs(jobs))
+                else:
+                    self._parse_jobs(jobs)
+            finally:
+                self.rich_progress.stop()
+            for entry, job in zip(due, jobs):
+                self.scheduler.complete(entry, job.changed_offers_counter, job.scraped_items_counter, job.failed)
+                self.logger.debug("%s: следующий парсинг через %.0f с, приоритет %.2f", entry.url, entry.next_run_at - time(), entry.score)
+            db_utils.flush()
+            if self.profiler is not None:
+                self.profiler.stop_cycle()
+            self._log_connections_stats()
+            cycle_metrics = self.metrics.take_cycle()
+            if self.logger.isEnabledFor(logging.INFO):
+                self.metrics.print_summary(cycle_metrics, by_connection=self.logger.isEnabledFor(logging.DEBUG))
+            cycle += 1
+        if self.profiler is not None:
+            self.profiler.close()
+        if watch_thread is not None:
+            # после последнего прохода перепроверять товары незачем
+            self.watchlist.close()
+            watch_thread.join()
+        for connection in self.connections:
+            connection.close()
+
+    def _watch_loop(self) -> None:
+        """Частая перепроверка предложений товаров из списка наблюдения, параллельно с полными проходами"""
+        while True:
+            batch = self.watchlist.take(len(self.connections))
+            if not batch:
+                return
+            self.logger.debug("Перепроверка товаров из списка наблюдения: %s", len(batch))
+            futures = {
+                self.offers_executor.submit(self._get_offers, watched.goods["goodsId"], delay=self.connection_success_delay, cache=False): watched
+                for watched in batch
+            }
+            for future in concurrent.futures.as_completed(futures):
+                watched = futures[future]
+                try:
+                    job = CrawlJob(watched.goods["webUrl"], job_name=watched.job_name)
+                    for offer in future.result():
+                        self._parse_offer(job, watched.goods, offer)
+                except Exception as exc:
+                    self.logger.warning("Ошибка перепроверки товара %s: %s", watched.goods["title"], exc)
+                finally:
+                    self.watchlist.done(watched)
+
+    def _log_connections_stats(self) -> None:
+        """Вывести статистику переиспользования и ожидания соединений"""
+        self.logger.debug(
+            "Ожидание соединения: запросов %s, среднее %.3f с, максимум %.3f с",
+            self.pool.acquire_count,
+            self.pool.wait_time_avg,
+            self.pool.wait_time_max,
+        )
+        self.logger.debug("Кэш запросов: записей %s, попаданий %s", len(self.request_cache), self.request_cache_hits)
+        if self.recorder is not None:
+            self.logger.info("Ответы api: записано %s, воспроизведено %s", self.recorder.saved, self.recorder.loaded)
+        for connection in self.connections:
+            self.logger.debug(
+                "Соединение %s: запросов %s, рукопожатий %s, переиспользовано %s, задержка %.3f с, ошибки %.0f%%, code 7: %s, интервал %.2f с",
+                connection.proxy_string,
+                connection.requests_count,
+                connection.handshakes_count,
+                connection.reused_count,
+                connection.latency_ewma,
+                connection.error_rate * 100,
+                connection.rate_limited_count,
+                connection.rate.delay,
+            )
+
+    def _parse_jobs(self, jobs: list[CrawlJob]) -> None:
+        """Парсинг url параллельно через общий пул соединений, не больше `url_threads` одновременно"""
+        max_workers = min(self.url_threads, len(jobs))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="url") as executor:
+            futures = {executor.submit(self._single_url, job): job for job in jobs}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except Exception:
+                    futures[future].failed = True
+                    self.logger.exception("Ошибка парсинга %s", futures[future].url)
+
+    def _single_url(self, job: CrawlJob) -> None:
+        self._prepare_job(job)
+        if job.parsed_url["type"] == "TYPE_PRODUCT_CARD":
+            self._parse_card(job)
         else:
-            self.logger.info("%s %s", self.job_name, self.start_time.strftime("%d-%m-%Y %H:%M:%S"))
-            self._parse_multi_page()
-            self.logger.info("Спаршено %s товаров", self.scraped_tems_counter)
+            self._parse_multi_page(job)
+        self._log_job_result(job)
+
+    def _prepare_job(self, job: CrawlJob) -> None:
+        """Разбор url задачи и автоопределение ее названия"""
+        job.start_time = datetime.now()
+        self.logger.info("Целевой URL: %s", job.url)
+        self.parse_input_url(job)
+        if job.parsed_url and not job.job_name:
+            search_text = job.parsed_url.get("searchText", {})
+            collection_title = (job.parsed_url.get("collection", {}) or {}).get("title")
+            merchant = (job.parsed_url.get("merchant", {}) or {}).get("slug")
+            unknown = "Не_определено"
+            job.job_name = search_text or collection_title or merchant or unknown
+            job.job_name = utils.slugify(job.job_name)
+
+    def _log_job_result(self, job: CrawlJob) -> None:
+        self.logger.info(
+            "%s %s: спаршено %s товаров, изменилось %s",
+            job.job_name,
+            job.start_time.strftime("%d-%m-%Y %H:%M:%S"),
+            job.scraped_items_counter,
+            job.changed_offers_counter,
+        )
 
     def _read_blacklist_file(self):
         blacklist_file_contents: str = open(self.blacklist_path, "r", encoding="utf-8").read()
         self.blacklist = [line for line in blacklist_file_contents.split("\n") if line]
 
-    def _export_to_db(self, parsed_offer: ParsedOffer) -> None:
+    def _export_to_db(self, job: CrawlJob, parsed_offer: ParsedOffer) -> None:
         """Экспорт одного предложения в базу данных"""
-        with self.lock:
-            db_utils.add_to_db(
-                self.job_id,
-                self.job_name,
-                parsed_offer.goods_id,
-                parsed_offer.merchant_id,
-                parsed_offer.url,
-                parsed_offer.title,
-                parsed_offer.price,
-                parsed_offer.price_bonus,
-                parsed_offer.bonus_amount,
-                parsed_offer.bonus_percent,
-                parsed_offer.available_quantity,
-                parsed_offer.delivery_date,
-                parsed_offer.merchant_name,
-                parsed_offer.merchant_rating,
-                parsed_offer.notified,
-            )
+        key = self._notify_state_key(parsed_offer.goods_id, parsed_offer.merchant_id, parsed_offer.price, parsed_offer.bonus_amount)
+        self.notify_state.setdefault(key, datetime.now())
+        # запись уходит в очередь фонового потока БД
+        db_utils.add_to_db(
+            job.job_id,
+            job.job_name,
+            parsed_offer.goods_id,
+            parsed_offer.merchant_id,
+            parsed_offer.url,
+            parsed_offer.title,
+            parsed_offer.price,
+            parsed_offer.price_bonus,
+            parsed_offer.bonus_amount,
+            parsed_offer.bonus_percent,
+            parsed_offer.available_quantity,
+            parsed_offer.delivery_date,
+            parsed_offer.merchant_name,
+            parsed_offer.merchant_rating,
+            parsed_offer.notified,
+        )
 
-    def parse_input_url(self, tries: int = 10) -> dict:
+    def parse_input_url(self, job: CrawlJob, tries: int = 10) -> dict:
         """Парсинг url мм с использованием api самого мм"""
-        json_data = {"url": self.url}
+        json_data = {"url": job.url}
         response_json = self._api_request(
-            "https://megamarket.ru/api/mobile/v1/urlService/url/parse",
+            self._api_url("urlService/url/parse"),
             json_data,
             tries=tries,
         )
         parsed_url = response_json["params"]
         parsed_url = self._filters_convert(parsed_url)
         parsed_url["type"] = response_json["type"]
-        sorting = int(dict(parse_qsl(unquote(urlparse(self.url).fragment.lstrip("?")))).get("sort", 0))
-        search_query_from_url = parse_qs(urlparse(self.url).query).get("q", "") or ""
+        sorting = int(dict(parse_qsl(unquote(urlparse(job.url).fragment.lstrip("?")))).get("sort", 0))
+        search_query_from_url = parse_qs(urlparse(job.url).query).get("q", "") or ""
         search_query_from_url = search_query_from_url[0] if search_query_from_url else None
         parsed_url["searchText"] = parsed_url["searchText"] or search_query_from_url
         parsed_url["sorting"] = sorting
-        self.parsed_url = parsed_url
+        job.parsed_url = parsed_url
         return parsed_url
 
     def _get_profile_default_address(self) -> None:
         """Получить данные адреса аккаунта мм"""
         json_data = {}
-        response_json = self._api_request("https://megamarket.ru/api/mobile/v1/profileService/address/list", json_data)
+        response_json = self._api_request(self._api_url("profileService/address/list"), json_data)
         address = [address for address in response_json["profileAddresses"] if address["isDefault"] is True]
         if address:
             self.address_id = address[0]["addressId"]
@@ -321,7 +726,7 @@ class Parser_url:
         """Установить адрес доставки по строке адреса"""
         json_data = {"count": 10, "isSkipRegionFilter": True, "query": address}
         response_json = self._api_request(
-            "https://megamarket.ru/api/mobile/v1/addressSuggestService/address/suggest",
+            self._api_url("addressSuggestService/address/suggest"),
             json_data,
         )
         address = response_json.get("items")
@@ -334,24 +739,40 @@ class Parser_url:
             sys.exit(f"По запросу {address} адрес не найден!")
 
     def _get_merchant_inn(self, merchant_id: str) -> str:
-        """Получить ИНН по ID продавца"""
+        """Получить ИНН по ID продавца, сначала из кэша"""
+        merchant_inn = self.merchant_inn_cache.get(merchant_id)
+        if merchant_inn is None:
+            merchant_inn = self.merchant_inn_flight.do(merchant_id, self._load_merchant_inn, merchant_id)
+        return merchant_inn
+
+    def _load_merchant_inn(self, merchant_id: str) -> str:
+        """Получить ИНН продавца из БД или api и закэшировать"""
+        merchant_inn = db_utils.get_merchant_inn(merchant_id)
+        if merchant_inn is None:
+            merchant_inn = self._request_merchant_inn(merchant_id)
+            db_utils.save_merchant_inn(merchant_id, merchant_inn)
+        self.merchant_inn_cache.set(merchant_id, merchant_inn)
+        return merchant_inn
+
+    def _request_merchant_inn(self, merchant_id: str) -> str:
+        """Получить ИНН по ID продавца через api"""
         json_data = {"merchantId": merchant_id}
-        response_json = self._api_request("https://megamarket.ru/api/mobile/v1/partnerService/merchant/legalInfo/get", json_data)
+        response_json = self._api_request(self._api_url("partnerService/merchant/legalInfo/get"), json_data)
         return response_json["merchant"]["legalInfo"]["inn"]
 
-    def _parse_item(self, item: dict):
+    def _parse_item(self, job: CrawlJob, item: dict, merchant_inn: str | None = None):
         """Парсинг дефолтного предложения товара"""
         if item["favoriteOffer"]["merchantName"] in self.blacklist:
             self.logger.debug("Пропуск %s", item["favoriteOffer"]["merchantName"])
             return
 
         if self.use_merchant_blacklist:
-            merchant_inn = self._get_merchant_inn(item["favoriteOffer"]["merchantId"])
+            merchant_inn = merchant_inn or self._get_merchant_inn(item["favoriteOffer"]["merchantId"])
             if merchant_inn in self.merchant_blacklist:
                 self.logger.debug("Пропуск %s", item["favoriteOffer"]["merchantName"])
                 return
 
-        self.scraped_tems_counter += 1
+        job.scraped_items_counter += 1
 
         delivery_date_iso: str = item["favoriteOffer"]["deliveryPossibilities"][0].get("displayDeliveryDate", "")
         delivery_date = delivery_date_iso.split("T")[0]
@@ -370,8 +791,7 @@ class Parser_url:
             image_url=item["goods"]["titleImage"],
         )
 
-        parsed_offer.notified = self._notify_if_notify_check(parsed_offer)
-        self._export_to_db(parsed_offer)
+        self._handle_parsed_offer(job, parsed_offer, item["goods"])
 
     def _filters_convert(self, parsed_url: dict) -> dict:
         """Конвертация фильтров каталога или поиска"""
@@ -384,14 +804,14 @@ class Parser_url:
                 url_filter["type"] = 2
         return parsed_url
 
-    def _parse_offer(self, item: dict, offer: dict) -> None:
+    def _parse_offer(self, job: CrawlJob, item: dict, offer: dict, merchant_inn: str | None = None) -> None:
         """Парсинг предложения товара"""
         if offer["merchantName"] in self.blacklist:
             self.logger.debug("Пропуск %s", offer["merchantName"])
             return
 
         if self.use_merchant_blacklist:
-            merchant_inn = self._get_merchant_inn(offer["merchantId"])
+            merchant_inn = merchant_inn or self._get_merchant_inn(offer["merchantId"])
             if merchant_inn in self.merchant_blacklist:
                 self.logger.debug("Пропуск %s", offer["merchantName"])
                 return
@@ -420,55 +840,135 @@ class Parser_url:
             image_url=None,
         )
 
-        self.scraped_tems_counter += 1
+        job.scraped_items_counter += 1
+        self._handle_parsed_offer(job, parsed_offer, item)
+
+    def _alert_check(self, parsed_offer: ParsedOffer, margin: float = 0) -> bool:
+        """Проверка предложения по параметрам уведомлений, пороги можно ослабить на долю `margin`"""
+        return (
+            parsed_offer.bonus_percent >= self.bonus_percent_alert * (1 - margin)
+            and parsed_offer.bonus_amount >= self.bonus_value_alert * (1 - margin)
+            and parsed_offer.price <= self.price_value_alert * (1 + margin)
+            and parsed_offer.price_bonus <= self.price_bonus_value_alert * (1 + margin)
+            and parsed_offer.price >= self.price_min_value_alert
+        )
+
+    def _watch_item(self, job: CrawlJob, item: dict) -> None:
+        """Поставить на наблюдение товар, процент бонусов которого немного не дотягивает до порога"""
+        bonus_percent = item["favoriteOffer"]["bonusPercent"]
+        if self.watchlist is not None and self.bonus_percent_alert * (1 - self.watch_margin) <= bonus_percent < self.bonus_percent_alert:
+            self.watchlist.add(item["goods"], job.job_name, bonus_percent)
+
+    def _watch_offer(self, job: CrawlJob, parsed_offer: ParsedOffer, goods: dict) -> None:
+        """Поставить на наблюдение товар, предложение которого немного не дотягивает до порогов уведомлений"""
+        if self.watchlist is not None and not self._alert_check(parsed_offer) and self._alert_check(parsed_offer, self.watch_margin):
+            self.watchlist.add(goods, job.job_name, parsed_offer.bonus_percent)
+
+    def _notify_state_key(self, goods_id, merchant_id, price, bonus_amount) -> tuple:
+        return (str(goods_id), str(merchant_id), price, bonus_amount)
+
+    def _load_notify_state(self) -> None:
+        """Заполнить кэш уведомлений из БД"""
+        now = datetime.now()
+        for goods_id, merchant_id, price, bonus_amount, scraped_at in db_utils.get_notify_state():
+            scraped_at = datetime.strptime(scraped_at, "%Y-%m-%d %H:%M:%S")
+            # записи живут в БД сутки, столько же и в кэше
+            ttl = NOTIFY_STATE_TTL - (now - scraped_at).total_seconds()
+            if ttl > 0:
+                self.notify_state.set(self._notify_state_key(goods_id, merchant_id, price, bonus_amount), scraped_at, ttl=ttl)
+
+    def _handle_parsed_offer(self, job: CrawlJob, parsed_offer: ParsedOffer, goods: dict) -> None:
+        """Уведомление и запись в БД, только если предложение изменилось с прошлого прохода"""
+        self._watch_offer(job, parsed_offer, goods)
+        if not self._offer_changed_check(parsed_offer):
+            # повторные уведомления зависят от того, что товар снова попался парсеру
+            if self.alert_repeat_timeout:
+                self._notify_if_notify_check(parsed_offer)
+            if self._offer_refresh_check(parsed_offer):
+                db_utils.touch_offer(parsed_offer.goods_id, parsed_offer.merchant_id, parsed_offer.price, parsed_offer.bonus_amount)
+            return
+        job.changed_offers_counter += 1
         parsed_offer.notified = self._notify_if_notify_check(parsed_offer)
-        self._export_to_db(parsed_offer)
+        self._export_to_db(job, parsed_offer)
+
+    def _offer_state(self, price, bonus_amount, available_quantity, delivery_date) -> int:
+        return hash((price, bonus_amount, available_quantity, delivery_date))
+
+    def _offer_changed_check(self, parsed_offer: ParsedOffer) -> bool:
+        """Сравнить предложение с последним увиденным состоянием и запомнить новое"""
+        key = (str(parsed_offer.goods_id), str(parsed_offer.merchant_id))
+        state = self._offer_state(parsed_offer.price, parsed_offer.bonus_amount, parsed_offer.available_quantity, parsed_offer.delivery_date)
+        with self.lock:
+            snapshot = self.offer_snapshot.get(key)
+            if snapshot is not None and snapshot[0] == state:
+                return False
+            self.offer_snapshot[key] = (state, time())
+        return True
+
+    def _offer_refresh_check(self, parsed_offer: ParsedOffer) -> bool:
+        """Пора ли обновить время записи неизменившегося предложения, чтобы оно не пропало из БД после очистки"""
+        key = (str(parsed_offer.goods_id), str(parsed_offer.merchant_id))
+        with self.lock:
+            state, exported_at = self.offer_snapshot[key]
+            if time() - exported_at < OFFER_REFRESH_AGE:
+                return False
+            self.offer_snapshot[key] = (state, time())
+        return True
+
+    def _load_offer_snapshot(self) -> None:
+        """Восстановить последние состояния предложений из БД"""
+        for goods_id, merchant_id, price, bonus_amount, available_quantity, delivery_date, scraped_at in db_utils.get_offer_snapshot():
+            exported_at = datetime.strptime(scraped_at, "%Y-%m-%d %H:%M:%S").timestamp()
+            self.offer_snapshot[(str(goods_id), str(merchant_id))] = (self._offer_state(price, bonus_amount, available_quantity, delivery_date), exported_at)
+
+    def _prune_offer_snapshot(self) -> None:
+        """Забыть предложения, записи которых уже удалены из БД"""
+        min_exported_at = time() - db_utils.RETENTION
+        with self.lock:
+            self.offer_snapshot = {key: value for key, value in self.offer_snapshot.items() if value[1] >= min_exported_at}
 
     def _notify_if_notify_check(self, parsed_offer: ParsedOffer):
         """Отправить уведомление в tg если предложение подходит по параметрам"""
+        if not self.tg_client or not self._alert_check(parsed_offer):
+            return False
+
         time_diff = 0
-        last_notified = None
-        last_notified = db_utils.get_last_notified(parsed_offer.goods_id, parsed_offer.merchant_id, parsed_offer.price, parsed_offer.bonus_amount)
-        last_notified = datetime.strptime(last_notified, "%Y-%m-%d %H:%M:%S") if last_notified else None
+        key = self._notify_state_key(parsed_offer.goods_id, parsed_offer.merchant_id, parsed_offer.price, parsed_offer.bonus_amount)
+        last_notified = self.notify_state.get(key)
         if last_notified:
             now = datetime.now()
             time_diff = now - last_notified
-                
-        if (
-            parsed_offer.bonus_percent >= self.bonus_percent_alert 
-             and parsed_offer.bonus_amount >= self.bonus_value_alert 
-             and parsed_offer.price <= self.price_value_alert 
-             and parsed_offer.price_bonus <= self.price_bonus_value_alert 
-             and parsed_offer.price >= self.price_min_value_alert
-            and (not last_notified or (last_notified and (time_diff.total_seconds() > self.alert_repeat_timeout * 3600 or not time_diff)))
-            and self.tg_client
-        ):
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                message = self._format_tg_message(parsed_offer)
-                executor.submit(self.tg_client.notify, message, parsed_offer.image_url)
-                self.perecup_price = None
-                return True
+
+        if not last_notified or (last_notified and (time_diff.total_seconds() > self.alert_repeat_timeout * 3600 or not time_diff)):
+            # уведомление сохраняется в очередь отправки TelegramClient, одно и то же
+            # предложение в пределах окна повтора ставится в очередь один раз
+            repeat_window = max(self.alert_repeat_timeout * 3600, 60)
+            idempotency_key = "{}:{}:{}:{}:{}".format(*key, int(time() // repeat_window))
+            message = self._format_tg_message(parsed_offer)
+            self.tg_client.notify(message, parsed_offer.image_url, idempotency_key)
+            self.perecup_price = None
+            return True
         return False
 
     def _format_tg_message(self, parsed_offer: ParsedOffer) -> str:
         """Форматировать данные для отправки в telegram"""
         return (
-            f'🛍 <b>Товар:</b> <a href="{parsed_offer.url}">{parsed_offer.title}</a>\n'
+            f'🛍 <b>Товар:</b> <a href="{html.escape(parsed_offer.url)}">{html.escape(parsed_offer.title)}</a>\n'
             f"💰 <b>Цена:</b> {parsed_offer.price}₽\n"
             f"💸 <b>Цена-Бонусы:</b> {parsed_offer.price_bonus}\n"
             f"🟢 <b>Бонусы:</b> {parsed_offer.bonus_amount}\n"
             f"🔢 <b>Процент Бонусов:</b> {parsed_offer.bonus_percent}\n"
             f"✅ <b>Доступно:</b> {parsed_offer.available_quantity or '?'}\n"
             f"📦 <b>Доставка:</b> {parsed_offer.delivery_date}\n"
-            f"🛒 <b>Продавец:</b> {parsed_offer.merchant_name} {parsed_offer.merchant_rating}{'⭐' if parsed_offer.merchant_rating else ''}\n"
+            f"🛒 <b>Продавец:</b> {html.escape(parsed_offer.merchant_name)} {parsed_offer.merchant_rating}{'⭐' if parsed_offer.merchant_rating else ''}\n"
             # f"☎️ <b>Аккаунт:</b> {self.profile.get('phone')}"
             # f"💰 <b>Цена перекупа:</b> {self.perecup_price}₽\n"
             # f"💰 <b>Выгода:</b> {self.perecup_price - parsed_offer.price + parsed_offer.bonus_amount}₽"
         )
 
-    def _get_offers(self, goods_id: str, delay: int = 0) -> list[dict]:
-        """Получить список предложений товара"""
-        json_data = {
+    def _offers_payload(self, goods_id: str) -> dict:
+        """Тело запроса списка предложений товара"""
+        return {
             "addressId": self.address_id,
             "collectionId": None,
             "goodsId": goods_id,
@@ -480,35 +980,45 @@ class Parser_url:
             "requestVersion": 11,
             "shopInfo": {},
         }
-        response_json = self._api_request("https://megamarket.ru/api/mobile/v1/catalogService/productOffers/get", json_data, delay=delay)
+
+    def _get_offers(self, goods_id: str, delay: int = 0, cache: bool = True) -> list[dict]:
+        """Получить список предложений товара"""
+        json_data = self._offers_payload(goods_id)
+        response_json = self._api_request(self._api_url("catalogService/productOffers/get"), json_data, delay=delay, cache=cache)
         return response_json["offers"]
 
-    def _get_page(self, offset: int) -> dict:
-        """Получить страницу каталога или поиска"""
+    def _page_payload(self, job: CrawlJob, offset: int, limit: int = None) -> dict:
+        """Тело запроса страницы каталога или поиска"""
+        parsed_url = job.parsed_url
         json_data = {
             "requestVersion": 10,
-            "limit": 44,
+            "limit": limit or job.page_limit or self.page_limit,
             "offset": offset,
-            "isMultiCategorySearch": self.parsed_url.get("isMultiCategorySearch", False),
+            "isMultiCategorySearch": parsed_url.get("isMultiCategorySearch", False),
             "searchByOriginalQuery": False,
             "selectedSuggestParams": [],
             "expandedFiltersIds": [],
-            "sorting": self.parsed_url["sorting"],
+            "sorting": parsed_url["sorting"],
             "ageMore18": None,
             "addressId": self.address_id,
             "showNotAvailable": True,
-            "selectedFilters": self.parsed_url.get("selectedListingFilters", []),
+            "selectedFilters": parsed_url.get("selectedListingFilters", []),
         }
-        if self.parsed_url.get("type", "") == "TYPE_MENU_NODE":
-            self.parsed_url["collection"] = self.parsed_url["collection"] or self.parsed_url["menuNode"]["collection"]
-        json_data["collectionId"] = self.parsed_url["collection"]["collectionId"] if self.parsed_url["collection"] else None
-        json_data["searchText"] = self.parsed_url["searchText"] if self.parsed_url["searchText"] else None
-        json_data["selectedAssumedCollectionId"] = self.parsed_url["collection"]["collectionId"] if self.parsed_url["collection"] else None
-        json_data["merchant"] = {"id": self.parsed_url["merchant"]["id"]} if self.parsed_url["merchant"] else None
+        if parsed_url.get("type", "") == "TYPE_MENU_NODE":
+            parsed_url["collection"] = parsed_url["collection"] or parsed_url["menuNode"]["collection"]
+        json_data["collectionId"] = parsed_url["collection"]["collectionId"] if parsed_url["collection"] else None
+        json_data["searchText"] = parsed_url["searchText"] if parsed_url["searchText"] else None
+        json_data["selectedAssumedCollectionId"] = parsed_url["collection"]["collectionId"] if parsed_url["collection"] else None
+        json_data["merchant"] = {"id": parsed_url["merchant"]["id"]} if parsed_url["merchant"] else None
+        return json_data
 
+    def _get_page(self, job: CrawlJob, offset: int, limit: int = None, tries: int = 10) -> dict:
+        """Получить страницу каталога или поиска"""
+        json_data = self._page_payload(job, offset, limit)
         response_json = self._api_request(
-            "https://megamarket.ru/api/mobile/v1/catalogService/catalog/search",
+            self._api_url("catalogService/catalog/search"),
             json_data,
+            tries=tries,
             delay=self.connection_success_delay,
         )
 
@@ -517,22 +1027,46 @@ class Parser_url:
         if response_json.get("success") is True:
             return response_json
 
-    def _parse_page(self, response_json: dict) -> bool:
+    def _parse_page(self, job: CrawlJob, response_json: dict) -> bool:
         """Парсинг страницы каталога или поиска"""
         items_per_page = int(response_json.get("limit"))
         if items_per_page == 0:
             # костыль для косяка мм
             return False
-        page_progress = self.rich_progress.add_task(f"[orange]Страница {int(int(response_json.get('offset')) / items_per_page) + 1}")
+        page_progress = self.rich_progress.add_task(f"[orange]{job.job_name}: страница {int(int(response_json.get('offset')) / items_per_page) + 1}")
         self.rich_progress.update(page_progress, total=len(response_json["items"]))
-        for item in response_json["items"]:
+        offers_futures = self._submit_page_offers(job, response_json["items"])
+        try:
+            self._parse_page_items(job, response_json["items"], offers_futures, page_progress)
+        finally:
+            for future in offers_futures.values():
+                future.cancel()
+
+        self.rich_progress.remove_task(page_progress)
+        parse_next_page = response_json["items"] and response_json["items"][-1]["isAvailable"]
+        return parse_next_page
+
+    def _submit_page_offers(self, job: CrawlJob, items: list[dict]) -> dict[int, concurrent.futures.Future]:
+        """Запросить предложения товаров страницы параллельно через общий пул соединений"""
+        offers_futures = {}
+        for index, item in enumerate(items):
+            if self._skip_item_check(item) or item["favoriteOffer"]["bonusPercent"] < self.bonus_percent_alert:
+                continue
+            if self._parse_offers_check(job, item):
+                offers_futures[index] = self.offers_executor.submit(
+                    self._get_offers, item["goods"]["goodsId"], delay=self.connection_success_delay
+                )
+        return offers_futures
+
+    def _parse_page_items(self, job: CrawlJob, items: list[dict], offers_futures: dict[int, concurrent.futures.Future], page_progress) -> None:
+        """Разбор товаров страницы по порядку"""
+        for index, item in enumerate(items):
             bonus_percent = item["favoriteOffer"]["bonusPercent"]
             item_title = item["goods"]["title"]
-            if self._exclude_check(item_title) or (item["isAvailable"] is not True) or (not self._include_check(item_title)):
+            if self._skip_item_check(item):
                 # пропускаем, если товар не доступен или исключен
                 self.rich_progress.update(page_progress, advance=1)
                 continue
-            is_listing = self.parsed_url["type"] == "TYPE_LISTING"
             # self.perecup_price = self._match_product(item_title, self._match_category(item_title, item["goods"]["attributes"]))
             # if "Apple" in item_title:
             #     file_name = "ZApple" + ''.join(random.choices(string.ascii_letters + string.digits, k=10)) + ".json"
@@ -548,14 +1082,16 @@ class Parser_url:
             #     json.dump(item, file, ensure_ascii=False, indent=4)
             # if self.perecup_price is None:
             if bonus_percent >= self.bonus_percent_alert:
-                if self.all_cards or (not self.no_cards and (item["hasOtherOffers"] or item["offerCount"] > 1 or is_listing)):
+                if self._parse_offers_check(job, item):
                     self.logger.info("Парсим предложения %s", item_title)
                     # print(item_title, bonus_percent)
-                    offers = self._get_offers(item["goods"]["goodsId"], delay=self.connection_success_delay)
+                    offers = offers_futures[index].result()
                     for offer in offers:
-                        self._parse_offer(item["goods"], offer)
+                        self._parse_offer(job, item["goods"], offer)
                 else:
-                    self._parse_item(item)
+                    self._parse_item(job, item)
+            else:
+                self._watch_item(job, item)
             # elif price < self.perecup_price:
             #     if self.all_cards or (not self.no_cards and (item["hasOtherOffers"] or item["offerCount"] > 1 or is_listing)):
             #         self.logger.info("Парсим предложения %s", item_title)
@@ -565,10 +1101,6 @@ class Parser_url:
             # else:
                 # self._parse_item(item)
             self.rich_progress.update(page_progress, advance=1)
-
-        self.rich_progress.remove_task(page_progress)
-        parse_next_page = response_json["items"] and response_json["items"][-1]["isAvailable"]
-        return parse_next_page
     
     def _match_category(self, input_string, attributes):
         # for category, method in self.category_methods.items():
@@ -608,6 +1140,16 @@ class Parser_url:
                 return attribute["value"]
         return None
 
+    def _skip_item_check(self, item: dict) -> bool:
+        """Проверка, что товар не доступен или исключен фильтрами"""
+        item_title = item["goods"]["title"]
+        return bool(self._exclude_check(item_title) or (item["isAvailable"] is not True) or (not self._include_check(item_title)))
+
+    def _parse_offers_check(self, job: CrawlJob, item: dict) -> bool:
+        """Проверка, нужно ли парсить все предложения товара, а не только дефолтное"""
+        is_listing = job.parsed_url["type"] == "TYPE_LISTING"
+        return self.all_cards or (not self.no_cards and (item["hasOtherOffers"] or item["offerCount"] > 1 or is_listing))
+
     def _exclude_check(self, title: str) -> bool:
         if self.exclude:
             return self.exclude.match(title)
@@ -632,59 +1174,136 @@ class Parser_url:
     def _get_card_info(self, goods_id: str) -> dict:
         """Получить карточку товара"""
         json_data = {"goodsId": goods_id, "merchantId": "0"}
-        response_json = self._api_request("https://megamarket.ru/api/mobile/v1/catalogService/productCardMainInfo/get", json_data)
+        response_json = self._api_request(self._api_url("catalogService/productCardMainInfo/get"), json_data)
         return response_json["goods"]
 
-    def _parse_card(self) -> None:
+    def _parse_card(self, job: CrawlJob) -> None:
         """Парсинг карточки товара"""
-        item = self._get_card_info(self.parsed_url["goods"]["goodsId"])
-        offers = self._get_offers(self.parsed_url["goods"]["goodsId"])
-        self.job_name = utils.slugify(item["title"])
-        self.job_id = db_utils.new_job(self.job_name)
+        item = self._get_card_info(job.parsed_url["goods"]["goodsId"])
+        offers = self._get_offers(job.parsed_url["goods"]["goodsId"])
+        job.job_name = utils.slugify(item["title"])
         for offer in offers:
-            self._parse_offer(item, offer)
+            self._parse_offer(job, item, offer)
 
-    def _process_page(self, offset: int, main_job) -> bool:
-        """Получение и парсинг страницы каталога или поиска"""
-        response_json = self._get_page(offset)
-        parse_next_page = self._parse_page(response_json)
+    def _process_page(self, job: CrawlJob, offset: int, main_job, window: PageWindow, response_json: dict = None) -> bool:
+        """Получение и парсинг страницы каталога или поиска, `response_json` - уже загруженная страница"""
+        response_json = response_json or self._get_page(job, offset)
+        if window.stale(offset):
+            # пока грузилась страница, на предыдущей закончились товары в наличии
+            return False
+        parse_next_page = self._parse_page(job, response_json)
         self.rich_progress.update(main_job, advance=1)
-        sleep(1)
+        if self.recorder is None or not self.recorder.replay:
+            sleep(1)
         return parse_next_page
 
-    def _parse_multi_page(self) -> None:
+    def _parse_multi_page(self, job: CrawlJob) -> None:
         """Запуск и менеджмент парсинга каталога или поиска"""
         start_offset = 0
-        response_json = self._get_page(start_offset)
+        response_json = self._probe_page_limit(job)
+        job.page_limit = self.page_limit
+        if response_json is None:
+            response_json = self._get_page(job, start_offset)
         if len(response_json["items"]) == 0 and response_json["processor"]["type"] in ("MENU_NODE", "COLLECTION"):
             self.logger.debug("Редирект в каталог")
-            self.url = urljoin("https://megamarket.ru", response_json["processor"]["url"])
-            return self.parse()
-        items_per_page = int(response_json.get("limit"))
-        item_count_total = int(response_json["total"])
+            job.url = urljoin("https://megamarket.ru", response_json["processor"]["url"])
+            self.parse_input_url(job)
+            return self._parse_multi_page(job)
 
-        pages_to_parse = list(range(start_offset, item_count_total, items_per_page))
-        self._create_progress_bar()
-        main_job = self.rich_progress.add_task("[green]Общий прогресс", total=len(pages_to_parse))
-        max_threads = min(len(pages_to_parse), self.threads)
-        while pages_to_parse:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=max_threads) as executor:
-                futures = {executor.submit(self._process_page, page, main_job): page for page in pages_to_parse}
-                for future in concurrent.futures.as_completed(futures):
+        window = self._plan_pages(job, response_json, start_offset)
+        # первая страница уже загружена, при ошибке разбора она загрузится заново
+        prefetched = {start_offset: response_json}
+        main_job = self.rich_progress.add_task(f"[green]{job.job_name}", total=window.total)
+        max_threads = max(1, min(window.total, job.threads))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_threads) as executor:
+            futures = {}
+            while not window.done:
+                for page in window.next_pages(max_threads):
+                    futures[executor.submit(self._process_page, job, page, main_job, window, prefetched.pop(page, None))] = page
+                done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    page = futures.pop(future)
                     try:
                         parse_next_page = future.result()
                     except Exception:
+                        window.fail(page)
                         continue
-                    page = futures[future]
-                    if page in pages_to_parse:
-                        pages_to_parse.remove(page)
-                    if not parse_next_page:
+                    stop = not parse_next_page and not window.stale(page)
+                    window.complete(page, parse_next_page)
+                    if stop:
                         self.logger.info("Дальше товары не в наличии, их не парсим")
-                        for fut in futures:
-                            future_page = futures[fut]
-                            if future_page > page:
-                                if future_page in pages_to_parse:
-                                    pages_to_parse.remove(future_page)
-                                self.rich_progress.update(main_job, total=len(pages_to_parse))
-                                fut.cancel()
-        self.rich_progress.stop()
+                        self.rich_progress.update(main_job, total=window.total)
+        window.checkpoint.clear()
+
+    def _plan_pages(self, job: CrawlJob, response_json: dict, start_offset: int) -> PageWindow:
+        """Окно страниц для парсинга по первой странице и сохраненному прогрессу"""
+        items_per_page = self._honored_page_limit(response_json, job.page_limit)
+        if items_per_page < job.page_limit:
+            self.logger.warning("Api урезает размер страницы до %s", items_per_page)
+            self.page_limit = min(self.page_limit, items_per_page)
+            job.page_limit = items_per_page
+        item_count_total = int(response_json["total"])
+        pages_to_parse = list(range(start_offset, item_count_total, items_per_page))
+        first_page_available = bool(response_json["items"]) and response_json["items"][-1]["isAvailable"]
+        if not first_page_available:
+            # товары в наличии закончились уже на первой странице
+            pages_to_parse = pages_to_parse[:1]
+        checkpoint = self._load_checkpoint(job, item_count_total, items_per_page)
+        confirmed_offset = start_offset if first_page_available else start_offset - items_per_page
+        return PageWindow(checkpoint, checkpoint.pending(pages_to_parse), items_per_page, self.page_window or job.threads, confirmed_offset)
+
+    def _honored_page_limit(self, response_json: dict, limit: int) -> int:
+        """Размер страницы, который api отдал на самом деле: limit может быть урезан молча"""
+        honored = int(response_json.get("limit") or limit)
+        items_count = len(response_json["items"])
+        if items_count and int(response_json["total"]) > items_count:
+            honored = min(honored, items_count)
+        return honored
+
+    def _probe_page_limit(self, job: CrawlJob) -> dict | None:
+        """Подобрать наибольший размер страницы, который отдает api, вернуть первую страницу url
+
+        Подбор выполняется один раз на первом url с товарами, остальные url ждут его результата.
+        """
+        with self.page_limit_lock:
+            if not self.page_limit_probe:
+                return None
+            for limit in PAGE_LIMIT_CANDIDATES:
+                try:
+                    response_json = self._probe_page(job, limit)
+                except ApiRejectedError:
+                    self.logger.debug("Api не отдает страницы по %s товаров", limit)
+                    continue
+                except ApiError:
+                    # ошибка соединения ничего не говорит о размере страницы, подбор повторится на следующем url
+                    self.logger.warning("Не удалось подобрать размер страницы: api недоступен")
+                    return None
+                if not response_json or not response_json["items"]:
+                    # по пустой выдаче размер страницы не определить
+                    return None
+                self.page_limit = self._honored_page_limit(response_json, limit)
+                self.page_limit_probe = False
+                self.logger.info("Размер страницы: %s", self.page_limit)
+                return response_json
+            self.page_limit_probe = False
+            self.logger.warning("Не удалось подобрать размер страницы, используем %s", self.page_limit)
+            return None
+
+    def _probe_page(self, job: CrawlJob, limit: int) -> dict:
+        """Первая страница url по `limit` товаров, отказ api на этот limit сразу поднимает ApiRejectedError"""
+        for i in range(PAGE_LIMIT_PROBE_TRIES):
+            try:
+                # по одной попытке, чтобы отказ api не повторялся
+                return self._get_page(job, 0, limit=limit, tries=1)
+            except ApiRejectedError:
+                raise
+            except ApiError:
+                if i == PAGE_LIMIT_PROBE_TRIES - 1:
+                    raise
+
+    def _load_checkpoint(self, job: CrawlJob, total: int, page_limit: int) -> "CrawlCheckpoint":
+        """Загрузить сохраненный прогресс парсинга url задачи"""
+        checkpoint = CrawlCheckpoint(job.url, job.parsed_url["sorting"], total, page_limit)
+        if checkpoint.restore(self.checkpoint_ttl * 60):
+            self.logger.info("Продолжаем парсинг, уже спаршено страниц: %s", len(checkpoint.completed_offsets))
+        return checkpoint
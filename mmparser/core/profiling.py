@@ -0,0 +1,139 @@
+"""Профилирование проходов парсера: cProfile по всем потокам или снимки tracemalloc"""
+
+import cProfile
+import pstats
+import sys
+import threading
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+from .exceptions import ConfigError
+
+PROFILE_MODES = ("cpu", "mem")
+# сколько строк в отчетах tracemalloc и как часто снимать память во время прохода, в секундах
+MEM_TOP_LIMIT = 25
+MEM_SNAPSHOT_INTERVAL = 30
+MEM_TRACEBACK_FRAMES = 10
+# с 3.12 cProfile работает через sys.monitoring: активен только один профайлер на интерпретатор,
+# и он видит все потоки. До 3.12 профайлер видит только свой поток
+PER_THREAD_PROFILERS = sys.version_info < (3, 12)
+
+
+class _StatsSnapshot:
+    """Снимок статистики профайлера для pstats.Stats, без остановки профайлера"""
+
+    def __init__(self, profiler: cProfile.Profile):
+        profiler.snapshot_stats()
+        self.stats = profiler.stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+class CycleProfiler:
+    """Профиль каждого прохода в отдельном файле каталога `output_dir`
+
+    cpu - cProfile в один .pstats на проход. До Python 3.12 в каждом потоке,
+    запущенном после создания профайлера, и в основном потоке свой профайлер,
+    их статистика сводится вместе, с 3.12 один профайлер видит все потоки.
+    mem - tracemalloc, в конце прохода снимок .tracemalloc и отчет с топом
+    выделений памяти, во время прохода топ пишется в отчет периодически.
+    """
+
+    def __init__(self, mode: str, output_dir: str, logger):
+        if mode not in PROFILE_MODES:
+            raise ConfigError(f"Неизвестный режим профилирования {mode}!")
+        self.mode = mode
+        self.output_dir = Path(output_dir) / datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.logger = logger
+        self.cycle = 0
+        self.lock = threading.Lock()
+        self.profilers: list[tuple[threading.Thread, cProfile.Profile]] = []
+        self.main_profiler: cProfile.Profile = None
+        self.start_snapshot: tracemalloc.Snapshot = None
+        self.stop_event = threading.Event()
+        self.snapshot_thread: threading.Thread = None
+        if mode == "cpu":
+            if PER_THREAD_PROFILERS:
+                threading.setprofile(self._profile_thread)
+        else:
+            tracemalloc.start(MEM_TRACEBACK_FRAMES)
+
+    def _profile_thread(self, *args) -> None:
+        """Первое событие нового потока: включить в нем собственный cProfile"""
+        profiler = cProfile.Profile()
+        with self.lock:
+            self.profilers.append((threading.current_thread(), profiler))
+        profiler.enable()
+
+    def start_cycle(self) -> None:
+        self.cycle += 1
+        if self.mode == "cpu":
+            self.main_profiler = cProfile.Profile()
+            self.main_profiler.enable()
+            return
+        self.start_snapshot = tracemalloc.take_snapshot()
+        self.stop_event.clear()
+        self.snapshot_thread = threading.Thread(target=self._snapshot_loop, args=(self.cycle,), name="tracemalloc", daemon=True)
+        self.snapshot_thread.start()
+
+    def stop_cycle(self) -> Path:
+        """Сохранить профиль прохода, возвращает путь к файлу"""
+        path = self._stop_cpu() if self.mode == "cpu" else self._stop_mem()
+        self.logger.info("Профиль прохода %s: %s", self.cycle, path)
+        return path
+
+    def _stop_cpu(self) -> Path:
+        self.main_profiler.disable()
+        stats = pstats.Stats(self.main_profiler)
+        with self.lock:
+            # профайлеры потоков продолжают работать, их статистика за проход сбрасывается
+            for thread, profiler in self.profilers:
+                snapshot = _StatsSnapshot(profiler)
+                if snapshot.stats:
+                    stats.add(snapshot)
+                profiler.clear()
+            self.profilers = [(thread, profiler) for thread, profiler in self.profilers if thread.is_alive()]
+        path = self.output_dir / f"cycle-{self.cycle:03d}.pstats"
+        stats.dump_stats(path)
+        return path
+
+    def _stop_mem(self) -> Path:
+        self.stop_event.set()
+        self.snapshot_thread.join()
+        snapshot = tracemalloc.take_snapshot()
+        snapshot.dump(str(self.output_dir / f"cycle-{self.cycle:03d}.tracemalloc"))
+        path = self.output_dir / f"cycle-{self.cycle:03d}-mem.txt"
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(self._format_top(snapshot, "конец прохода"))
+            f.write(self._format_top(snapshot.compare_to(self.start_snapshot, "lineno"), "прирост за проход"))
+        return path
+
+    def _snapshot_loop(self, cycle: int) -> None:
+        path = self.output_dir / f"cycle-{cycle:03d}-mem.txt"
+        while not self.stop_event.wait(MEM_SNAPSHOT_INTERVAL):
+            snapshot = tracemalloc.take_snapshot()
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(self._format_top(snapshot, datetime.now().strftime("%H:%M:%S")))
+
+    def _format_top(self, snapshot_or_diff, title: str) -> str:
+        if isinstance(snapshot_or_diff, tracemalloc.Snapshot):
+            current, peak = tracemalloc.get_traced_memory()
+            title = f"{title}: {current / 1024 / 1024:.1f} МБ, пик {peak / 1024 / 1024:.1f} МБ"
+            stats = snapshot_or_diff.statistics("lineno")
+        else:
+            stats = snapshot_or_diff
+        lines = [f"# {title}"] + [str(stat) for stat in stats[:MEM_TOP_LIMIT]]
+        return "\n".join(lines) + "\n\n"
+
+    def close(self) -> None:
+        if self.mode == "cpu":
+            # уже запущенные потоки профилируются до своего завершения, новые - нет
+            if PER_THREAD_PROFILERS:
+                threading.setprofile(None)
+            with self.lock:
+                self.profilers = []
+        else:
+            tracemalloc.stop()
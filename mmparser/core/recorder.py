@@ -0,0 +1,58 @@
+"""Запись ответов api и воспроизведение без сети"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from .exceptions import ApiError, ConfigError
+from .metrics import api_method
+
+
+class ApiRecorder:
+    """Хранилище пар запрос-ответ api в каталоге `path`
+
+    Ответ лежит в `<метод api>/<хэш тела запроса>.json.gz`, при повторной
+    записи того же запроса сохраняется последний ответ. В режиме `replay`
+    ответы берутся только из каталога.
+    """
+
+    def __init__(self, path: str, replay: bool = False):
+        self.path = Path(path)
+        self.replay = replay
+        self.lock = threading.Lock()
+        self.saved = 0
+        self.loaded = 0
+        if replay and not self.path.is_dir():
+            raise ConfigError(f"Нет каталога с записями api {self.path}!")
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _file(self, api_url: str, json_data: dict) -> Path:
+        """Файл записи: каталог по методу api, имя по хэшу тела запроса"""
+        endpoint = api_method(api_url).replace("/", "_")
+        payload = json.dumps(json_data, sort_keys=True, ensure_ascii=False)
+        return self.path / endpoint / f"{hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]}.json.gz"
+
+    def save(self, api_url: str, json_data: dict, response: dict) -> None:
+        file = self._file(api_url, json_data)
+        file.parent.mkdir(exist_ok=True)
+        record = {"url": api_url, "request": json_data, "response": response}
+        # пишем во временный файл, чтобы параллельное чтение не увидело недописанную запись
+        tmp_file = file.with_name(f"{file.name}.{threading.get_ident()}.tmp")
+        with gzip.open(tmp_file, "wt", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp_file, file)
+        with self.lock:
+            self.saved += 1
+
+    def load(self, api_url: str, json_data: dict) -> dict:
+        file = self._file(api_url, json_data)
+        try:
+            with gzip.open(file, "rt", encoding="utf-8") as f:
+                record = json.load(f)
+        except FileNotFoundError as exc:
+            raise ApiError(f"Нет записи ответа api {api_url} {file.name}") from exc
+        with self.lock:
+            self.loaded += 1
+        return record["response"]
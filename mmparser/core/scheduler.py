@@ -0,0 +1,80 @@
+"""Планировщик повторного парсинга url"""
+
+from time import time
+
+from .exceptions import ConfigError
+
+
+class ScheduledUrl:
+    """Url с интервалом обновления, приоритетом и статистикой изменений"""
+
+    def __init__(self, url: str, job_name: str = "", interval: float = 0, priority: float = 0):
+        self.url = url
+        self.job_name = job_name
+        self.interval = interval
+        self.priority = priority
+        self.next_run_at = 0.0
+        # подряд проходов без изменившихся предложений
+        self.idle_runs = 0
+        # EWMA доли изменившихся предложений за проход
+        self.change_rate = 0.0
+
+    @property
+    def score(self) -> float:
+        """Приоритет из конфига, при равенстве вперед url, где чаще меняются предложения"""
+        return self.priority + self.change_rate
+
+
+class CrawlScheduler:
+    """Выбор url, которые пора парсить
+
+    Url без изменений откладываются с экспоненциально растущей задержкой,
+    url с изменениями парсятся с интервалом из конфига. Url без интервала
+    и все url при `backoff=False` парсятся без отсрочки.
+    """
+
+    CHANGE_RATE_ALPHA = 0.3
+    IDLE_BASE_DELAY = 60
+    MAX_IDLE_DELAY = 1800
+
+    def __init__(self, targets: list[str | dict], interval: float = 0, backoff: bool = True):
+        self.backoff = backoff
+        self.entries = [self._create_entry(target, interval) for target in targets]
+
+    @staticmethod
+    def _create_entry(target: str | dict, interval: float) -> ScheduledUrl:
+        """Url строкой или словарем {"url", "job_name", "interval", "priority"}, интервал в минутах"""
+        if isinstance(target, str):
+            return ScheduledUrl(target, interval=interval * 60)
+        if not isinstance(target, dict) or not target.get("url"):
+            raise ConfigError(f"Неверный url в конфиге: {target}")
+        return ScheduledUrl(
+            target["url"],
+            job_name=target.get("job_name", ""),
+            interval=float(target.get("interval", interval)) * 60,
+            priority=float(target.get("priority", 0)),
+        )
+
+    def due(self) -> list[ScheduledUrl]:
+        """Url, которые пора парсить, по убыванию приоритета"""
+        current_time = time()
+        entries = [entry for entry in self.entries if entry.next_run_at <= current_time]
+        return sorted(entries, key=lambda entry: entry.score, reverse=True)
+
+    def wait_time(self) -> float:
+        """Сколько ждать до следующего url"""
+        return max(0.0, min(entry.next_run_at for entry in self.entries) - time())
+
+    def complete(self, entry: ScheduledUrl, changed: int, scraped: int, failed: bool = False) -> None:
+        """Учесть результат прохода и запланировать следующий"""
+        if not failed:
+            change_rate = changed / scraped if scraped else 0.0
+            entry.change_rate = self.CHANGE_RATE_ALPHA * change_rate + (1 - self.CHANGE_RATE_ALPHA) * entry.change_rate
+            entry.idle_runs = 0 if changed else entry.idle_runs + 1
+        entry.next_run_at = time() + self._delay(entry)
+
+    def _delay(self, entry: ScheduledUrl) -> float:
+        if not entry.idle_runs or not entry.interval or not self.backoff:
+            return entry.interval
+        delay = max(entry.interval, self.IDLE_BASE_DELAY) * 2 ** (entry.idle_runs - 1)
+        return min(delay, max(entry.interval, self.MAX_IDLE_DELAY))
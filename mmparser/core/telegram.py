@@ -1,5 +1,29 @@
+import atexit
+import threading
+import uuid
+from dataclasses import dataclass
+from time import sleep, time
+
 from curl_cffi import requests
 
+from . import db_utils
+
+TELEGRAM_API_URL = "https://api.telegram.org"
+MESSAGE_MAX_LENGTH = 4096
+MEDIA_GROUP_MAX_SIZE = 10
+# Лимиты Telegram: ~30 сообщений в секунду на бота, 1 в секунду в личный чат, 20 в минуту в группу
+GLOBAL_RATE = 30
+PRIVATE_CHAT_RATE = 1
+GROUP_CHAT_RATE = 20 / 60
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 900.0
+# после стольких неудачных попыток уведомление больше не отправляется
+MAX_ATTEMPTS = 10
+# Сколько уведомлений забирать из БД за раз и на сколько секунд их резервировать под отправку
+BATCH_LIMIT = 50
+SEND_LEASE = 60.0
+POLL_INTERVAL = 5.0
+
 
 def validate_tg_credentials(tg_config: str):
     def is_valid_token(bot_token):
@@ -21,7 +45,58 @@ def validate_tg_credentials(tg_config: str):
     return True
 
 
+class TokenBucket:
+    """Ограничение частоты: `rate` токенов в секунду, не больше `capacity` подряд"""
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time()
+
+    def _refill(self) -> None:
+        current_time = time()
+        self.tokens = min(self.capacity, self.tokens + (current_time - self.updated_at) * self.rate)
+        self.updated_at = current_time
+
+    def wait_time(self) -> float:
+        """Сколько ждать до появления токена"""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def consume(self) -> None:
+        """Дождаться и забрать токен"""
+        wait_time = self.wait_time()
+        if wait_time:
+            sleep(wait_time)
+            self._refill()
+        self.tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        """Не выдавать токены `seconds` секунд, например по retry_after от Telegram"""
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+@dataclass
+class Notification:
+    id: int
+    idempotency_key: str
+    message: str
+    image_url: str | None = None
+    attempts: int = 0
+
+
 class TelegramClient:
+    """Клиент Telegram с надежной очередью отправки в БД
+
+    `notify` сохраняет уведомление в таблицу notifications и сразу возвращает управление.
+    Фоновый поток забирает неотправленные уведомления, отправляет их через постоянную
+    сессию с учетом лимитов Telegram, склеивая накопившиеся в одно сообщение или альбом,
+    и помечает отправленными только после успешного ответа. Неудачные отправки
+    повторяются с экспоненциальной задержкой, в том числе после перезапуска парсера.
+    """
+
     def __init__(self, tg_config, logger):
         self.bot_token = tg_config.split("$")[0]
         self.chat_id = tg_config.split("$")[1]
@@ -29,22 +104,127 @@ class TelegramClient:
         if not self.bot_token or not self.chat_id:
             raise Exception("Не валидный конфиг Telegram!")
 
-    def notify(self, message, image_url=None):
-        if image_url:
-            base_url = f"https://api.telegram.org/bot{self.bot_token}/sendPhoto"
-            params = {"chat_id": self.chat_id, "caption": message, "photo": image_url, "parse_mode": "HTML"}
-            try:
-                response = requests.get(base_url, params=params)
-                response.raise_for_status()
-                self.logger.info("Уведомление успешно отправлено!")
-            except Exception as e:
-                self.logger.info(f"Ошибка отправки сообщения с картинкой: {e}")
-        else:
-            base_url = f"https://api.telegram.org/bot{self.bot_token}/sendMessage"
-            params = {"chat_id": self.chat_id, "text": message, "parse_mode": "HTML"}
+        self.session = requests.Session(impersonate="chrome")
+        is_group = self.chat_id.startswith("-")
+        self.chat_bucket = TokenBucket(GROUP_CHAT_RATE if is_group else PRIVATE_CHAT_RATE)
+        self.global_bucket = TokenBucket(GLOBAL_RATE, capacity=GLOBAL_RATE)
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="telegram-outbox", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def notify(self, message, image_url=None, idempotency_key=None):
+        """Сохранить уведомление в очередь отправки
+
+        Уведомление с уже сохраненным `idempotency_key` повторно не ставится.
+        """
+        idempotency_key = idempotency_key or uuid.uuid4().hex
+        if db_utils.add_notification(idempotency_key, message, image_url):
+            self._wakeup.set()
+
+    def close(self, timeout: float = 10) -> None:
+        """Попытаться отправить очередь и остановить фоновый поток
+
+        Неотправленные уведомления остаются в БД до следующего запуска.
+        """
+        if self._stopping:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while True:
             try:
-                response = requests.get(base_url, params=params)
+                batch = self._next_batch()
+                if batch:
+                    self._send_batch(batch)
+            except Exception:
+                self.logger.exception("Ошибка очереди уведомлений")
+                sleep(POLL_INTERVAL)
+                continue
+            if self._stopping and not batch:
+                return
+
+    def _next_batch(self) -> list[Notification]:
+        """Дождаться уведомлений и забрать все накопившиеся, пока ждем лимит чата"""
+        if not self._stopping:
+            next_attempt_at = db_utils.get_next_notification_time()
+            timeout = POLL_INTERVAL if next_attempt_at is None else min(POLL_INTERVAL, max(0.0, next_attempt_at - time()))
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+        # пока ждем токен, в очереди копятся новые уведомления
+        sleep(self.chat_bucket.wait_time())
+        rows = db_utils.claim_notifications(BATCH_LIMIT, SEND_LEASE)
+        return [Notification(*row) for row in rows]
+
+    def _send_batch(self, batch: list[Notification]) -> None:
+        """Отправить пачку уведомлений минимальным числом запросов"""
+        with_images = [obj for obj in batch if obj.image_url]
+        text_only = [obj for obj in batch if not obj.image_url]
+        for start in range(0, len(with_images), MEDIA_GROUP_MAX_SIZE):
+            group = with_images[start : start + MEDIA_GROUP_MAX_SIZE]
+            if len(group) == 1:
+                self._send(*self._single_request(group[0]), group)
+            else:
+                media = [{"type": "photo", "media": obj.image_url, "caption": obj.message, "parse_mode": "HTML"} for obj in group]
+                self._send("sendMediaGroup", {"chat_id": self.chat_id, "media": media}, group)
+        for group in self._pack_messages(text_only):
+            text = "\n\n".join(obj.message for obj in group)
+            self._send("sendMessage", {"chat_id": self.chat_id, "text": text, "parse_mode": "HTML"}, group)
+
+    def _single_request(self, notification: Notification) -> tuple[str, dict]:
+        """Метод и параметры отправки одного уведомления"""
+        if notification.image_url:
+            return "sendPhoto", {"chat_id": self.chat_id, "caption": notification.message, "photo": notification.image_url, "parse_mode": "HTML"}
+        return "sendMessage", {"chat_id": self.chat_id, "text": notification.message, "parse_mode": "HTML"}
+
+    def _pack_messages(self, notifications: list[Notification]) -> list[list[Notification]]:
+        """Сгруппировать текстовые уведомления в сообщения не длиннее лимита Telegram"""
+        groups: list[list[Notification]] = []
+        length = 0
+        for notification in notifications:
+            message_length = len(notification.message) + 2
+            if groups and length + message_length <= MESSAGE_MAX_LENGTH:
+                groups[-1].append(notification)
+                length += message_length
+            else:
+                groups.append([notification])
+                length = message_length
+        return groups
+
+    def _send(self, method: str, params: dict, notifications: list[Notification]) -> bool:
+        self.chat_bucket.consume()
+        self.global_bucket.consume()
+        url = f"{TELEGRAM_API_URL}/bot{self.bot_token}/{method}"
+        try:
+            response = self.session.post(url, json=params)
+            if response.status_code == 429:
+                retry_after = response.json().get("parameters", {}).get("retry_after", RETRY_BASE_DELAY)
+                self.chat_bucket.pause(retry_after)
+                raise Exception(f"слишком частые запросы, повтор через {retry_after} с")
+            # Telegram отклонил склеенную пачку, например из-за разметки одного из уведомлений
+            rejected = 400 <= response.status_code < 500 and len(notifications) > 1
+            if not rejected:
                 response.raise_for_status()
-                self.logger.info("Сообщение успешно отправлено!")
-            except Exception as e:
-                self.logger.info(f"Ошибка отправки сообщения: {e}")
+        except Exception as e:
+            self.logger.info(f"Ошибка отправки уведомления: {e}")
+            self._schedule_retry(notifications)
+            return False
+        if rejected:
+            self.logger.info(f"Пачка уведомлений отклонена ({response.status_code}), отправка по одному")
+            return all([self._send(*self._single_request(obj), [obj]) for obj in notifications])
+        db_utils.mark_notifications_sent([obj.id for obj in notifications])
+        self.logger.info("Уведомление успешно отправлено!" if len(notifications) == 1 else f"Отправлено уведомлений: {len(notifications)}")
+        return True
+
+    def _schedule_retry(self, notifications: list[Notification]) -> None:
+        for notification in notifications:
+            notification.attempts += 1
+            if notification.attempts >= MAX_ATTEMPTS:
+                self.logger.warning(f"Уведомление не отправлено за {notification.attempts} попыток и больше не повторяется")
+                db_utils.mark_notification_dead(notification.id, notification.attempts)
+                continue
+            retry_delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (notification.attempts - 1))
+            db_utils.reschedule_notification(notification.id, notification.attempts, time() + retry_delay)
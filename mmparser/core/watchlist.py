@@ -0,0 +1,91 @@
+"""Список наблюдения за товарами, близкими к порогам уведомлений"""
+
+import heapq
+import threading
+from dataclasses import dataclass, field
+from time import time
+
+
+@dataclass
+class WatchedGoods:
+    goods: dict
+    job_name: str
+    score: float
+    expires_at: float
+    next_poll_at: float = field(default=0.0)
+
+
+class Watchlist:
+    """Очередь товаров на частую перепроверку предложений
+
+    Товар проверяется раз в `interval` секунд, пока снова попадает в список
+    и не прошло `ttl` секунд с последнего попадания. Из готовых к проверке
+    первыми выдаются товары с большим `score`.
+    """
+
+    def __init__(self, interval: float, ttl: float, maxsize: int = 1000):
+        self.interval = interval
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._goods: dict[str, WatchedGoods] = {}
+        self._heap: list[tuple[float, float, str]] = []
+        self._condition = threading.Condition()
+        self.closed = False
+
+    def add(self, goods: dict, job_name: str, score: float) -> None:
+        """Поставить товар на наблюдение или продлить наблюдение"""
+        goods_id = goods["goodsId"]
+        with self._condition:
+            watched = self._goods.get(goods_id)
+            if watched is not None:
+                watched.expires_at = time() + self.ttl
+                watched.score = score
+                return
+            if len(self._goods) >= self.maxsize:
+                return
+            watched = WatchedGoods(
+                goods={"goodsId": goods_id, "title": goods["title"], "webUrl": goods["webUrl"]},
+                job_name=job_name,
+                score=score,
+                expires_at=time() + self.ttl,
+                next_poll_at=time() + self.interval,
+            )
+            self._goods[goods_id] = watched
+            heapq.heappush(self._heap, (watched.next_poll_at, -score, goods_id))
+            self._condition.notify()
+
+    def take(self, limit: int) -> list[WatchedGoods]:
+        """Дождаться и забрать до `limit` товаров, которые пора проверить, пустой список - наблюдение остановлено"""
+        with self._condition:
+            while not self.closed:
+                current_time = time()
+                due = []
+                while self._heap and self._heap[0][0] <= current_time:
+                    due.append(heapq.heappop(self._heap))
+                if due:
+                    due.sort(key=lambda entry: entry[1])
+                    for entry in due[limit:]:
+                        heapq.heappush(self._heap, entry)
+                    return [self._goods[entry[2]] for entry in due[:limit]]
+                self._condition.wait(self._heap[0][0] - current_time if self._heap else None)
+            return []
+
+    def done(self, watched: WatchedGoods) -> None:
+        """Вернуть проверенный товар в очередь или снять с наблюдения, если он давно не попадал в список"""
+        goods_id = watched.goods["goodsId"]
+        with self._condition:
+            if watched.expires_at <= time():
+                del self._goods[goods_id]
+                return
+            watched.next_poll_at = time() + self.interval
+            heapq.heappush(self._heap, (watched.next_poll_at, -watched.score, goods_id))
+            self._condition.notify()
+
+    def close(self) -> None:
+        """Остановить наблюдение, ожидающий `take` сразу возвращается"""
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def __len__(self) -> int:
+        return len(self._goods)
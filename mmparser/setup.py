@@ -6,7 +6,7 @@ setup(
     description="Парсер megamarket.ru",
     author="xob0t",
     url="https://github.com/xob0t/mmparser",
-    packages=find_packages(),
+    packages=find_packages(exclude=["tests", "tests.*", "benchmarks", "benchmarks.*"]),
     install_requires=[
         "setuptools",
         "rich",
@@ -0,0 +1,63 @@
+import threading
+import unittest
+from time import sleep
+
+from core.cache import LRUCache, SingleFlight
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(len(cache), 2)
+
+    def test_ttl(self):
+        cache = LRUCache(ttl=0.05)
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        sleep(0.06)
+        self.assertIsNone(cache.get("a"))
+
+    def test_set_drops_expired(self):
+        cache = LRUCache(ttl=0.05)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        sleep(0.06)
+        cache.set("c", 3)
+        self.assertEqual(len(cache), 1)
+
+    def test_setdefault_keeps_first_value(self):
+        cache = LRUCache()
+        self.assertEqual(cache.setdefault("a", 1), 1)
+        self.assertEqual(cache.setdefault("a", 2), 1)
+        cache.set("b", 1, ttl=-1)
+        self.assertEqual(cache.setdefault("b", 2), 2)
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_share_result(self):
+        flight = SingleFlight()
+        calls = []
+
+        def load(key):
+            calls.append(key)
+            sleep(0.05)
+            return key * 2
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do("k", load, 21))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [42] * 5)
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
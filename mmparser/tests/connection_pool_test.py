@@ -0,0 +1,103 @@
+import threading
+import unittest
+from time import time
+
+from core.connection_pool import ConnectionPool
+from core.models import Connection, RateController
+from tests.mock_api import MockApi
+
+
+class TestConnection(unittest.TestCase):
+    def test_post_reuses_session(self):
+        connection = Connection(None)
+        with MockApi() as api:
+            for _ in range(3):
+                response = connection.post(api.base_url + "/catalogService/catalog/search", {"offset": 0, "limit": 1})
+                self.assertEqual(response.status_code, 200)
+            connection.close()
+        self.assertEqual(connection.requests_count, 3)
+        # одно рукопожатие, дальше keep-alive
+        self.assertEqual(connection.handshakes_count, 1)
+        self.assertEqual(connection.reused_count, 2)
+
+
+class TestConnectionPool(unittest.TestCase):
+    def test_acquire_oldest(self):
+        first, second = Connection("http://first"), Connection("http://second")
+        first.usable_at = time() + 60
+        pool = ConnectionPool([first, second])
+        self.assertIs(pool.acquire(), second)
+        self.assertTrue(second.busy)
+
+    def test_acquire_waits_for_release(self):
+        connection = Connection(None)
+        pool = ConnectionPool([connection])
+        pool.acquire()
+        timer = threading.Timer(0.1, pool.release, args=(connection, 0))
+        timer.start()
+        started_at = time()
+        self.assertIs(pool.acquire(), connection)
+        self.assertGreaterEqual(time() - started_at, 0.09)
+        self.assertEqual(pool.acquire_count, 2)
+        self.assertGreaterEqual(pool.wait_time_max, 0.09)
+
+    def test_acquire_waits_for_usable_at(self):
+        connection = Connection(None)
+        pool = ConnectionPool([connection])
+        pool.release(pool.acquire(), time() + 0.1)
+        started_at = time()
+        pool.acquire()
+        self.assertGreaterEqual(time() - started_at, 0.09)
+
+    def test_per_connection_limit(self):
+        connection = Connection(None)
+        pool = ConnectionPool([connection], per_connection_limit=2)
+        self.assertIs(pool.try_acquire()[0], connection)
+        self.assertIs(pool.try_acquire()[0], connection)
+        self.assertEqual(pool.try_acquire(), (None, None))
+        released = []
+        pool.add_listener(lambda: released.append(True))
+        pool.release(connection, time() + 60)
+        self.assertTrue(connection.busy)
+        self.assertEqual(released, [True])
+        connection, wait_time = pool.try_acquire()
+        self.assertIsNone(connection)
+        self.assertGreater(wait_time, 59)
+
+    def test_quarantine(self):
+        connection = Connection(None)
+        pool = ConnectionPool([connection])
+        for _ in range(Connection.QUARANTINE_ERRORS - 1):
+            self.assertFalse(connection.record_error())
+        self.assertTrue(connection.record_error())
+        pool.release(pool.acquire(), 0)
+        self.assertGreaterEqual(connection.usable_at - time(), Connection.QUARANTINE_BASE_DELAY - 1)
+        # повторная проверка после карантина: одна ошибка удваивает срок
+        self.assertTrue(connection.record_error())
+        self.assertGreaterEqual(connection.quarantined_until - time(), 2 * Connection.QUARANTINE_BASE_DELAY - 1)
+        connection.record_success(0.1)
+        self.assertEqual(connection.quarantine_count, 0)
+
+    def test_last_connection_not_quarantined(self):
+        first, second = Connection(None), Connection("http://second")
+        pool = ConnectionPool([first, second])
+        for _ in range(Connection.QUARANTINE_ERRORS):
+            pool.record_error(first)
+        self.assertTrue(first.quarantined)
+        for _ in range(Connection.QUARANTINE_ERRORS):
+            self.assertFalse(pool.record_error(second))
+        self.assertFalse(second.quarantined)
+        self.assertEqual(second.errors_count, Connection.QUARANTINE_ERRORS)
+
+    def test_rate_controller_aimd(self):
+        rate = RateController(delay=1.0, min_delay=0.5, max_delay=3.0)
+        for _ in range(RateController.SUCCESS_STREAK * 10):
+            rate.on_success()
+        self.assertEqual(rate.delay, 0.5)
+        for _ in range(5):
+            rate.on_rate_limit()
+        self.assertEqual(rate.delay, 3.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,21 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from core import db_utils
+
+
+class TempDbTestCase(unittest.TestCase):
+    """Тест с отдельной БД storage.sqlite во временном каталоге `tmp_dir`"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filename = db_utils.FILENAME
+        db_utils.close_db()
+        db_utils.FILENAME = str(Path(self.tmp_dir.name) / "storage.sqlite")
+        db_utils.create_db()
+
+    def tearDown(self):
+        db_utils.close_db()
+        db_utils.FILENAME = self.filename
+        self.tmp_dir.cleanup()
@@ -0,0 +1,70 @@
+import unittest
+
+from core import db_utils
+from tests.db_case import TempDbTestCase
+
+
+class TestDbUtils(TempDbTestCase):
+    def _add(self, price=100, bonus_amount=10):
+        db_utils.add_to_db(None, "job", "1", "2", "url", "title", price, price - bonus_amount, bonus_amount, 10, 1, "2024-01-01", "merchant", None, False)
+
+    def test_add_to_db_dedupe(self):
+        self._add()
+        self._add()
+        self._add(price=90)
+        db_utils.flush()
+        rows = db_utils.execute_read("SELECT price FROM products ORDER BY price")
+        self.assertEqual(rows, [(90,), (100,)])
+        self.assertIsNotNone(db_utils.get_last_notified("1", "2", 100, 10))
+        self.assertIsNone(db_utils.get_last_notified("1", "2", 80, 10))
+
+    def test_failed_write_keeps_batch(self):
+        self._add()
+        # повтор первичного ключа: ошибочный запрос в середине пачки
+        for _ in range(2):
+            db_utils.execute_write("INSERT INTO merchants (merchant_id, inn) VALUES (?, ?)", ("3", "7700"))
+        self._add(price=90)
+        with self.assertLogs("rich", "ERROR"):
+            db_utils.flush()
+        rows = db_utils.execute_read("SELECT price FROM products ORDER BY price")
+        self.assertEqual(rows, [(90,), (100,)])
+
+    def test_indexes(self):
+        plan = db_utils.execute_read(
+            "EXPLAIN QUERY PLAN SELECT scraped_at FROM products WHERE goods_id = ? AND merchant_id = ? AND price = ? AND bonus_amount = ? ORDER BY scraped_at DESC",
+            ("1", "2", 100, 10),
+        )
+        self.assertIn("idx_products_offer", str(plan))
+        plan = db_utils.execute_read("EXPLAIN QUERY PLAN DELETE FROM products WHERE scraped_at < ?", ("2024-01-01",))
+        self.assertIn("idx_products_scraped_at", str(plan))
+        self.assertEqual(db_utils.execute_read("PRAGMA user_version"), [(max(db_utils.MIGRATIONS),)])
+
+    def test_notifications(self):
+        self.assertTrue(db_utils.add_notification("key", "message", None))
+        self.assertFalse(db_utils.add_notification("key", "message", None))
+        rows = db_utils.claim_notifications(limit=10, lease=60)
+        self.assertEqual([row[1:] for row in rows], [("key", "message", None, 0)])
+        # уведомление зарезервировано под отправку
+        self.assertEqual(db_utils.claim_notifications(limit=10, lease=60), [])
+        db_utils.reschedule_notification(rows[0][0], 1, 0)
+        self.assertEqual(len(db_utils.claim_notifications(limit=10, lease=60)), 1)
+        db_utils.mark_notifications_sent([rows[0][0]])
+        db_utils.reschedule_notification(rows[0][0], 1, 0)
+        self.assertEqual(db_utils.claim_notifications(limit=10, lease=60), [])
+
+    def test_checkpoint(self):
+        db_utils.save_checkpoint("url", 0, 100, 44, {0, 44}, None)
+        self.assertEqual(db_utils.get_checkpoint("url", max_age=60), (0, 100, 44, {0, 44}, None))
+        self.assertIsNone(db_utils.get_checkpoint("url", max_age=-1))
+        db_utils.delete_checkpoint("url")
+        self.assertIsNone(db_utils.get_checkpoint("url", max_age=60))
+
+    def test_merchant_inn(self):
+        db_utils.save_merchant_inn("2", "7700")
+        db_utils.flush()
+        self.assertEqual(db_utils.get_merchant_inn("2"), "7700")
+        self.assertIsNone(db_utils.get_merchant_inn("3"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+
+from core.parser_url import CrawlCheckpoint, PageWindow
+from tests.db_case import TempDbTestCase
+
+
+class TestPageWindow(TempDbTestCase):
+    def _window(self, size=2):
+        checkpoint = CrawlCheckpoint("https://megamarket.ru/catalog/?q=x", 0, 440, 44)
+        return PageWindow(checkpoint, list(range(0, 440, 44)), 44, size, confirmed_offset=0)
+
+    def test_window_ahead_of_confirmed_page(self):
+        window = self._window()
+        self.assertEqual(window.next_pages(max_in_flight=8), [0, 44, 88])
+        window.complete(44, True)
+        self.assertEqual(window.next_pages(max_in_flight=8), [132])
+        window.fail(0)
+        self.assertEqual(window.next_pages(max_in_flight=8), [0])
+
+    def test_stop_drops_later_pages(self):
+        window = self._window()
+        window.next_pages(max_in_flight=8)
+        window.complete(44, False)
+        self.assertTrue(window.stale(88))
+        self.assertEqual(window.total, 2)
+        window.complete(88, False)
+        window.complete(0, True)
+        self.assertTrue(window.done)
+        self.assertEqual(window.checkpoint.completed_offsets, {0, 44})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,280 @@
+import copy
+import threading
 import unittest
+from pathlib import Path
+from time import sleep, time
+from unittest import mock
+
+from core import db_utils, telegram
+from core.exceptions import ApiError
 from core.parser_url import Parser_url
+from tests.db_case import TempDbTestCase
+from tests.mock_api import RATE_LIMIT_RESPONSE, MockApi
+
+SEARCH_URL = "https://megamarket.ru/catalog/?q=%D0%BD%D0%BE%D1%83%D1%82%D0%B1%D1%83%D0%BA"
 
 
-class TestMain(unittest.TestCase):
+class TestParse(TempDbTestCase):
+    def _parse(self, api, url=SEARCH_URL, **kwargs):
+        options = dict(urls=[], delay=0.01, min_delay=0.01, error_delay=0.01, bonus_percent_alert=1, log_level="WARNING")
+        options.update(kwargs)
+        with api:
+            self.parser = Parser_url(url=url, api_base_url=api.base_url, cycles=1, **options)
+            self.parser.parse()
+        return db_utils.execute_read("SELECT goods_id, merchant_id FROM products")
+
     def test_parse(self):
-        parser_instance = Parser_url(url="https://megamarket.ru/catalog/?q=lays%20%D0%B8%D0%B7%20%D0%BF%D0%B5%D1%87%D0%B8&suggestionType=constructor", log_level="DEBUG")
-        parser_instance.parse()
+        api = MockApi(total=100, available=80)
+        with mock.patch("core.utils.check_for_new_version") as check_for_new_version:
+            rows = self._parse(api, threads=2)
+        # с подмененным адресом api проверка обновлений не ходит в сеть
+        check_for_new_version.assert_not_called()
+        # 80 товаров в наличии, на каждые 5 товаров фикстуры 10 предложений
+        self.assertEqual(len({goods_id for goods_id, _ in rows}), 80)
+        self.assertEqual(len(rows), 160)
+        self.assertEqual(api.calls["catalogService/catalog/search"], 3)
+
+    def test_parse_async(self):
+        api = MockApi(total=100, available=80)
+        rows = self._parse(api, threads=2, engine="async", per_connection_limit=2)
+        self.assertEqual(len(rows), 160)
+        # асинхронные запросы тоже учитываются в статистике соединения
+        connection = self.parser.connections[0]
+        api_calls = sum(count for method, count in api.calls.items() if not method.startswith("telegram/"))
+        self.assertEqual(connection.requests_count, api_calls)
+        self.assertGreater(connection.reused_count, 0)
+        self.assertLess(connection.handshakes_count, connection.requests_count)
+
+    def test_parse_urls(self):
+        api = MockApi(total=100, latency=0.01)
+        urls = [f"https://megamarket.ru/catalog/?q=url{index}" for index in range(4)]
+
+        def url_parse(payload):
+            # поисковый запрос берется из url, у каждого url своя выдача
+            response = copy.deepcopy(api.url_parse)
+            response["params"]["searchText"] = None
+            return response
+
+        api.methods["urlService/url/parse"] = url_parse
+        catalog_search = api.methods["catalogService/catalog/search"]
+        offsets = {url: set() for url in urls}
+
+        def recording_search(payload):
+            offsets[f"https://megamarket.ru/catalog/?q={payload['searchText']}"].add(payload["offset"])
+            return catalog_search(payload)
+
+        api.methods["catalogService/catalog/search"] = recording_search
+        single_url = Parser_url._single_url
+        lock = threading.Lock()
+        active = []
+        max_active = 0
+
+        def counting_single_url(parser, job):
+            nonlocal max_active
+            with lock:
+                active.append(job.url)
+                max_active = max(max_active, len(active))
+            try:
+                single_url(parser, job)
+            finally:
+                with lock:
+                    active.remove(job.url)
+
+        with mock.patch.object(Parser_url, "_single_url", counting_single_url):
+            self._parse(api, urls=urls, url_threads=2, threads=4, no_cards=True)
+        # каждый url спаршен целиком, одновременно не больше url_threads
+        self.assertEqual(offsets, {url: {0, 44, 88} for url in urls})
+        self.assertEqual(max_active, 2)
+
+    def test_resume_from_checkpoint(self):
+        for engine in ("threads", "async"):
+            with self.subTest(engine=engine):
+                api = MockApi(total=200)
+                catalog_search = api.methods["catalogService/catalog/search"]
+                offsets = []
+
+                def recording_search(payload):
+                    offsets.append(payload["offset"])
+                    return catalog_search(payload)
+
+                api.methods["catalogService/catalog/search"] = recording_search
+                # прошлый проход успел спарсить 3 из 5 страниц
+                db_utils.save_checkpoint(SEARCH_URL, 0, 200, 44, {0, 44, 132}, None)
+                self._parse(api, engine=engine, threads=2, no_cards=True)
+                # первая страница нужна для числа товаров, дальше только оставшиеся
+                self.assertEqual(sorted(offsets), [0, 88, 176])
+                self.assertIsNone(db_utils.get_checkpoint(SEARCH_URL, max_age=3600))
+
+    def test_watchlist_renotify(self):
+        api = MockApi(total=5)
+        with api, mock.patch.object(telegram, "TELEGRAM_API_URL", api.address):
+            # у товаров каталога 8-35% бонусов: 35% и 30% попадают на наблюдение, уведомлений в проходе нет
+            parser = Parser_url(
+                url=SEARCH_URL, urls=[], api_base_url=api.base_url, cycles=1, bonus_percent_alert=45, watch_margin=0.5, watch_interval=0.001,
+                tg_config="0:watch$1", delay=0.01, min_delay=0.01, error_delay=0.01, log_level="WARNING",
+            )  # fmt: skip
+            cycle_done, watch_done = threading.Event(), threading.Event()
+            log_connections_stats = parser._log_connections_stats
+
+            def wait_for_watch():
+                # проход закончен, перепроверки идут, пока тест не отпустит парсер
+                cycle_done.set()
+                watch_done.wait(10)
+                log_connections_stats()
+
+            parser._log_connections_stats = wait_for_watch
+            thread = threading.Thread(target=parser.parse)
+            thread.start()
+            try:
+                self.assertTrue(cycle_done.wait(10))
+                self.assertEqual(len(parser.watchlist), 2)
+                self.assertEqual(self._notifications(), 0)
+                # между перепроверками первое предложение поднимает бонусы до 50%
+                api.offers[0]["bonusAmountFinalPrice"] = api.offers[0]["finalPrice"] // 2
+                self.assertTrue(self._wait(lambda: self._notifications() == 2))
+                # цена товара меняется снова, уведомление приходит повторно
+                api.items[1]["favoriteOffer"]["finalPrice"] -= 1000
+                self.assertTrue(self._wait(lambda: self._notifications() == 3))
+                messages = [message for (message,) in db_utils.execute_read("SELECT message FROM notifications ORDER BY id")]
+                self.assertIn("51990₽", messages[-1])
+            finally:
+                watch_done.set()
+                thread.join()
+            parser.tg_client.close(timeout=0)
+
+    def _notifications(self) -> int:
+        return db_utils.execute_read("SELECT COUNT(*) FROM notifications")[0][0]
+
+    @staticmethod
+    def _wait(condition, timeout: float = 10) -> bool:
+        deadline = time() + timeout
+        while not condition():
+            if time() > deadline:
+                return False
+            sleep(0.01)
+        return True
+
+    def test_parse_card(self):
+        api = MockApi()
+        rows = self._parse(api, url="https://megamarket.ru/catalog/details/noutbuk-100000000003/")
+        self.assertEqual(len(rows), 3)
+
+    def test_page_limit_probe(self):
+        api = MockApi(total=300, max_limit=100)
+        rows = self._parse(api, page_limit="auto", no_cards=True, threads=3)
+        self.assertEqual(self.parser.page_limit, 100)
+        self.assertEqual(len(rows), 300)
+        # первая страница подбора используется как первая страница парсинга
+        self.assertEqual(api.calls["catalogService/catalog/search"], 3)
+
+    def test_page_limit_rejected(self):
+        api = MockApi(total=300, max_limit=100, reject_limit_above=100)
+        rows = self._parse(api, page_limit="auto", no_cards=True, threads=3)
+        self.assertEqual(self.parser.page_limit, 100)
+        self.assertEqual(len(rows), 300)
+        # один отказ на 200 и три страницы по 100
+        self.assertEqual(api.calls["catalogService/catalog/search"], 4)
+
+    def test_page_limit_probe_rate_limited(self):
+        api = MockApi(total=300, max_limit=200)
+        catalog_search = api.methods["catalogService/catalog/search"]
+        calls = []
+
+        def rate_limited_search(payload):
+            calls.append(payload["limit"])
+            # лимит запросов на первые два запроса подбора не должен уменьшать размер страницы
+            return dict(RATE_LIMIT_RESPONSE) if len(calls) <= 2 else catalog_search(payload)
+
+        api.methods["catalogService/catalog/search"] = rate_limited_search
+        rows = self._parse(api, page_limit="auto", no_cards=True, threads=3)
+        self.assertEqual(self.parser.page_limit, 200)
+        self.assertEqual(len(rows), 300)
+        self.assertEqual(calls, [200, 200, 200, 200])
+
+    def test_page_limit_clamped(self):
+        api = MockApi(total=100, max_limit=30)
+        with self.assertLogs("rich", "WARNING") as logs:
+            rows = self._parse(api, no_cards=True, threads=4)
+        self.assertIn("Api урезает размер страницы до 30", "\n".join(logs.output))
+        self.assertEqual(self.parser.page_limit, 30)
+        self.assertEqual(len(rows), 100)
+        self.assertEqual(api.calls["catalogService/catalog/search"], 4)
+
+    def test_unchanged_offers_skipped(self):
+        self.assertEqual(len(self._parse(MockApi(total=20))), 40)
+        # новый парсер восстанавливает состояния предложений из БД и не пишет неизменившиеся
+        self.assertEqual(len(self._parse(MockApi(total=20))), 40)
+        api = MockApi(total=20)
+        # у 8 из 20 товаров есть второе предложение, его цена меняется
+        api.offers[1]["finalPrice"] += 100
+        self.assertEqual(len(self._parse(api)), 48)
+
+    def _parser(self, api, **kwargs) -> Parser_url:
+        """Парсер с соединениями, без прохода"""
+        parser = Parser_url(url=SEARCH_URL, urls=[], api_base_url=api.base_url, log_level="WARNING", **kwargs)
+        parser.parsed_proxies = None
+        parser._proxies_set_up()
+        return parser
+
+    def test_request_coalescing_and_cache(self):
+        with MockApi(latency=0.1) as api:
+            parser = self._parser(api, request_cache_ttl=0.5)
+            offers_url = parser._api_url("catalogService/productOffers/get")
+            results = []
+            threads = [
+                threading.Thread(target=lambda: results.append(parser._api_request(offers_url, parser._offers_payload(api.goods_id(0)))))
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(api.calls["catalogService/productOffers/get"], 1)
+            # каждый вызов получает свою копию ответа
+            results[0]["offers"].clear()
+            self.assertEqual(len(parser._api_request(offers_url, parser._offers_payload(api.goods_id(0)))["offers"]), 4)
+            self.assertEqual((api.calls["catalogService/productOffers/get"], parser.request_cache_hits), (1, 1))
+            sleep(0.6)
+            parser._api_request(offers_url, parser._offers_payload(api.goods_id(0)))
+            self.assertEqual(api.calls["catalogService/productOffers/get"], 2)
+            # страницы каталога не кэшируются
+            for _ in range(2):
+                parser._api_request(parser._api_url("catalogService/catalog/search"), {"offset": 0, "limit": 44})
+            self.assertEqual(api.calls["catalogService/catalog/search"], 2)
+
+    def test_unchanged_offers_survive_retention(self):
+        self.assertEqual(len(self._parse(MockApi(total=20))), 40)
+        # записи старше половины срока хранения: время записи неизменившихся предложений обновляется
+        db_utils.execute_commit("UPDATE products SET scraped_at = datetime('now', 'localtime', '-13 hours')")
+        self.assertEqual(len(self._parse(MockApi(total=20))), 40)
+        # еще 12 часов: необновленные записи вышли бы за срок хранения и удалились очисткой
+        db_utils.execute_commit("UPDATE products SET scraped_at = datetime(scraped_at, '-12 hours')")
+        db_utils.delete_old_entries()
+        db_utils.flush()
+        self.assertEqual(len(db_utils.execute_read("SELECT goods_id FROM products")), 40)
+
+    def test_api_errors_keep_connection_healthy(self):
+        with MockApi(error_rate=1) as api:
+            parser = self._parser(api)
+            connection = parser.connections[0]
+            with self.assertRaises(ApiError):
+                parser._send_api_request(parser._api_url("catalogService/catalog/search"), {}, tries=2, delay=0)
+            self.assertEqual(connection.errors_count, 2)
+            api.error_rate = 0
+            # ответ 404 - ошибка api, а не соединения
+            with self.assertRaises(ApiError):
+                parser._send_api_request(parser._api_url("unknownService/get"), {}, tries=2, delay=0)
+            self.assertEqual(connection.errors_count, 2)
+            self.assertFalse(connection.quarantined)
+
+    def test_rate_limit_and_errors(self):
+        api = MockApi(total=50, rate_limit=5, error_rate=0.02)
+        # мок работает и как прокси: 4 соединения, у каждого свой лимит запросов
+        proxy_file = Path(self.tmp_dir.name) / "proxies.txt"
+        proxy_file.write_text("\n".join(api.proxy_url(f"client{i}") for i in range(4)))
+        rows = self._parse(api, threads=2, proxy_file_path=str(proxy_file), error_delay=0.25)
+        self.assertGreater(api.rate_limited + api.errors, 0)
+        self.assertEqual(len({goods_id for goods_id, _ in rows}), 50)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,71 @@
+import logging
+import pstats
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from core import profiling
+from core.exceptions import ConfigError
+from core.profiling import CycleProfiler
+
+
+def busy_worker():
+    return sum(i * i for i in range(10000))
+
+
+class TestCycleProfiler(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.logger = logging.getLogger("profiling_test")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _run_cycle(self, profiler):
+        profiler.start_cycle()
+        thread = threading.Thread(target=busy_worker)
+        thread.start()
+        thread.join()
+        return profiler.stop_cycle()
+
+    def test_cpu_profile_includes_threads(self):
+        profiler = CycleProfiler("cpu", self.tmp_dir.name, self.logger)
+        try:
+            first = self._run_cycle(profiler)
+            second = self._run_cycle(profiler)
+        finally:
+            profiler.close()
+        self.assertEqual((first.name, second.name), ("cycle-001.pstats", "cycle-002.pstats"))
+        functions = {function for _, _, function in pstats.Stats(str(second)).stats}
+        self.assertIn("busy_worker", functions)
+
+    @mock.patch.object(profiling, "PER_THREAD_PROFILERS", False)
+    def test_cpu_profile_single_profiler(self):
+        profiler = CycleProfiler("cpu", self.tmp_dir.name, self.logger)
+        try:
+            self.assertIsNone(threading.getprofile())
+            path = self._run_cycle(profiler)
+        finally:
+            profiler.close()
+        functions = {function for _, _, function in pstats.Stats(str(path)).stats}
+        self.assertIn("start", functions)
+
+    def test_mem_profile(self):
+        profiler = CycleProfiler("mem", self.tmp_dir.name, self.logger)
+        try:
+            path = self._run_cycle(profiler)
+        finally:
+            profiler.close()
+        report = path.read_text(encoding="utf-8")
+        self.assertIn("# конец прохода", report)
+        self.assertIn("# прирост за проход", report)
+        self.assertTrue(path.with_name("cycle-001.tracemalloc").exists())
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ConfigError):
+            CycleProfiler("io", self.tmp_dir.name, self.logger)
+
+
+if __name__ == "__main__":
+    unittest.main()
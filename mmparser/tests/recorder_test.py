@@ -0,0 +1,54 @@
+import unittest
+from pathlib import Path
+
+from core import db_utils
+from core.exceptions import ApiError
+from core.parser_url import Parser_url
+from core.recorder import ApiRecorder
+from tests.db_case import TempDbTestCase
+from tests.mock_api import MockApi
+from tests.parse_test import SEARCH_URL
+
+
+class TestApiRecorder(TempDbTestCase):
+    def setUp(self):
+        super().setUp()
+        self.records_dir = str(Path(self.tmp_dir.name) / "records")
+
+    def test_save_load(self):
+        recorder = ApiRecorder(self.records_dir)
+        url = "https://megamarket.ru/api/mobile/v1/catalogService/catalog/search"
+        recorder.save(url, {"offset": 0, "limit": 44}, {"items": [1]})
+        replay = ApiRecorder(self.records_dir, replay=True)
+        self.assertEqual(replay.load(url, {"limit": 44, "offset": 0}), {"items": [1]})
+        self.assertTrue(list(Path(self.records_dir, "catalogService_catalog_search").glob("*.json.gz")))
+        with self.assertRaises(ApiError):
+            replay.load(url, {"offset": 44, "limit": 44})
+
+    def _parse(self, api_base_url, **kwargs):
+        parser = Parser_url(
+            url=SEARCH_URL,
+            urls=[],
+            api_base_url=api_base_url,
+            cycles=1,
+            delay=0.01,
+            min_delay=0.01,
+            bonus_percent_alert=1,
+            log_level="WARNING",
+            **kwargs,
+        )
+        parser.parse()
+        return sorted(db_utils.execute_read("SELECT goods_id, merchant_id, price FROM products"))
+
+    def test_record_replay(self):
+        with MockApi(total=100, available=80) as api:
+            recorded = self._parse(api.base_url, record_dir=self.records_dir)
+        # мок остановлен, все ответы из записей
+        db_utils.execute_commit("DELETE FROM products")
+        replayed = self._parse(api.base_url, replay_dir=self.records_dir)
+        self.assertEqual(len(recorded), 160)
+        self.assertEqual(replayed, recorded)
+
+
+if __name__ == "__main__":
+    unittest.main()
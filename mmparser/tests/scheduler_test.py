@@ -0,0 +1,40 @@
+import unittest
+from time import time
+
+from core.exceptions import ConfigError
+from core.scheduler import CrawlScheduler
+
+
+class TestCrawlScheduler(unittest.TestCase):
+    def test_config_entries(self):
+        scheduler = CrawlScheduler(["https://a", {"url": "https://b", "interval": 5, "priority": 2}], interval=1)
+        first, second = scheduler.entries
+        self.assertEqual((first.interval, first.priority), (60, 0))
+        self.assertEqual((second.interval, second.priority), (300, 2))
+        self.assertEqual([entry.url for entry in scheduler.due()], ["https://b", "https://a"])
+        with self.assertRaises(ConfigError):
+            CrawlScheduler([{"interval": 5}])
+
+    def test_idle_url_backs_off(self):
+        scheduler = CrawlScheduler(["https://a", {"url": "https://b", "interval": 0}], interval=1)
+        idle, active = scheduler.entries
+        for _ in range(3):
+            scheduler.complete(idle, changed=0, scraped=10)
+            scheduler.complete(active, changed=5, scraped=10)
+        self.assertAlmostEqual(idle.next_run_at - time(), 4 * CrawlScheduler.IDLE_BASE_DELAY, delta=1)
+        self.assertEqual([entry.url for entry in scheduler.due()], ["https://b"])
+        self.assertGreater(active.change_rate, 0)
+        scheduler.complete(idle, changed=1, scraped=10)
+        self.assertEqual(idle.idle_runs, 0)
+        self.assertAlmostEqual(idle.next_run_at - time(), idle.interval, delta=1)
+
+    def test_no_backoff_without_interval(self):
+        for scheduler in (CrawlScheduler(["https://a"]), CrawlScheduler(["https://a"], interval=1, backoff=False)):
+            entry = scheduler.entries[0]
+            for _ in range(3):
+                scheduler.complete(entry, changed=0, scraped=10)
+            self.assertAlmostEqual(entry.next_run_at - time(), entry.interval, delta=1)
+
+
+if __name__ == "__main__":
+    unittest.main()
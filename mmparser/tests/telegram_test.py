@@ -0,0 +1,91 @@
+import logging
+import unittest
+from time import time
+
+from core import db_utils, telegram
+from core.telegram import Notification, TelegramClient, TokenBucket
+from tests.db_case import TempDbTestCase
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def json(self):
+        return {"ok": self.status_code == 200}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise Exception(f"HTTP {self.status_code}")
+
+
+class FakeSession:
+    """Отвечает 400 на склеенные сообщения с битой разметкой"""
+
+    def __init__(self):
+        self.requests = []
+
+    def post(self, url, json):
+        self.requests.append((url.rsplit("/", 1)[-1], json))
+        return FakeResponse(400 if "<b>" in json.get("text", "") else 200)
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_consume_waits_for_token(self):
+        bucket = TokenBucket(rate=20, capacity=2)
+        started_at = time()
+        for _ in range(3):
+            bucket.consume()
+        # два токена сразу, третий через 1/rate
+        self.assertGreaterEqual(time() - started_at, 0.045)
+        self.assertLess(time() - started_at, 0.5)
+        self.assertGreater(bucket.wait_time(), 0)
+
+    def test_pause(self):
+        bucket = TokenBucket(rate=10)
+        bucket.pause(0.5)
+        self.assertAlmostEqual(bucket.wait_time(), 0.6, delta=0.01)
+
+
+class TestTelegramClient(TempDbTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = TelegramClient("token$1", logging.getLogger("telegram_test"))
+        # фоновая отправка не нужна, пачки отправляются из теста
+        self.client.close()
+        self.client.session = FakeSession()
+        self.client.chat_bucket = TokenBucket(1000, capacity=1000)
+        self.client.global_bucket = TokenBucket(1000, capacity=1000)
+
+    def _claim(self, *messages):
+        for index, message in enumerate(messages):
+            db_utils.add_notification(str(index), message, None)
+        return [Notification(*row) for row in db_utils.claim_notifications(telegram.BATCH_LIMIT, 0)]
+
+    def _pending(self):
+        return db_utils.execute_read("SELECT message, attempts, next_attempt_at IS NULL FROM notifications WHERE sent_at IS NULL")
+
+    def test_pack_messages(self):
+        notifications = [Notification(index, str(index), text) for index, text in enumerate(["a" * 2000, "b" * 2000, "c" * 2000, "d" * 5000, "e"])]
+        groups = self.client._pack_messages(notifications)
+        self.assertEqual([[obj.id for obj in group] for group in groups], [[0, 1], [2], [3], [4]])
+
+    def test_rejected_group_is_sent_one_by_one(self):
+        self.client._send_batch(self._claim("first", "broken <b>", "third"))
+        methods = [method for method, _ in self.client.session.requests]
+        self.assertEqual(methods, ["sendMessage"] * 4)
+        self.assertEqual([message for message, _, _ in self._pending()], ["broken <b>"])
+
+    def test_dead_after_max_attempts(self):
+        notification = self._claim("broken <b>")[0]
+        notification.attempts = telegram.MAX_ATTEMPTS - 2
+        self.client._send_batch([notification])
+        self.assertEqual(self._pending(), [("broken <b>", telegram.MAX_ATTEMPTS - 1, 0)])
+        self.client._send_batch([notification])
+        self.assertEqual(self._pending(), [("broken <b>", telegram.MAX_ATTEMPTS, 1)])
+        self.assertIsNone(db_utils.get_next_notification_time())
+        self.assertEqual(db_utils.claim_notifications(telegram.BATCH_LIMIT, 0), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import threading
+import unittest
+from time import sleep, time
+
+from core.watchlist import Watchlist
+
+
+def goods(goods_id):
+    return {"goodsId": goods_id, "title": f"Товар {goods_id}", "webUrl": f"https://megamarket.ru/{goods_id}/", "attributes": []}
+
+
+class TestWatchlist(unittest.TestCase):
+    def test_take_due_by_score(self):
+        watchlist = Watchlist(interval=0.05, ttl=60)
+        watchlist.add(goods("1"), "job", 10)
+        watchlist.add(goods("2"), "job", 20)
+        watchlist.add(goods("1"), "job", 15)
+        self.assertEqual(len(watchlist), 2)
+        started_at = time()
+        batch = watchlist.take(limit=1)
+        self.assertGreaterEqual(time() - started_at, 0.04)
+        self.assertEqual([watched.goods["goodsId"] for watched in batch], ["2"])
+        self.assertNotIn("attributes", batch[0].goods)
+        self.assertEqual([watched.goods["goodsId"] for watched in watchlist.take(limit=5)], ["1"])
+
+    def test_done_drops_expired(self):
+        watchlist = Watchlist(interval=0, ttl=0.05)
+        watchlist.add(goods("1"), "job", 10)
+        watched = watchlist.take(limit=1)[0]
+        watchlist.done(watched)
+        self.assertEqual(len(watchlist), 1)
+        watchlist.take(limit=1)
+        sleep(0.06)
+        watchlist.done(watched)
+        self.assertEqual(len(watchlist), 0)
+
+    def test_close_wakes_take(self):
+        watchlist = Watchlist(interval=60, ttl=60)
+        watchlist.add(goods("1"), "job", 10)
+        threading.Timer(0.05, watchlist.close).start()
+        self.assertEqual(watchlist.take(limit=1), [])
+
+
+if __name__ == "__main__":
+    unittest.main()